@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+"""
+Benchmark de codificación JPEG de frames 1080p sintéticos
+Compara la ruta PIL (BGRA -> RGB -> JPEG) con libjpeg-turbo sobre el buffer BGRA
+
+Uso: python benchmarks/bench_turbojpeg.py [repeticiones]
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import numpy as np
+from PIL import Image
+
+from modules.frame_encoders import ENCODERS, get_encoder
+from modules.screen_capture import RawFrame
+
+WIDTH, HEIGHT = 1920, 1080
+QUALITY = 70
+
+
+def synthetic_bgra():
+    """Buffer BGRA 1080p con degradados y bloques, como el que entrega mss"""
+    y, x = np.mgrid[0:HEIGHT, 0:WIDTH]
+    frame = np.zeros((HEIGHT, WIDTH, 4), dtype=np.uint8)
+    frame[..., 0] = (x * 255 // WIDTH).astype(np.uint8)
+    frame[..., 1] = (y * 255 // HEIGHT).astype(np.uint8)
+    frame[..., 2] = ((x // 64 + y // 64) % 2 * 200).astype(np.uint8)
+    frame[..., 3] = 255
+    return bytearray(frame.tobytes())
+
+
+def legacy_rgb(bgra):
+    """Conversión anterior: BGRA -> bytes RGB (como mss .rgb) -> Image.frombytes"""
+    array = np.frombuffer(bgra, dtype=np.uint8).reshape(HEIGHT, WIDTH, 4)
+    rgb = array[..., 2::-1].tobytes()
+    return Image.frombytes('RGB', (WIDTH, HEIGHT), rgb)
+
+
+def bench(label, func, repeat):
+    func()
+    start = time.perf_counter()
+    for _ in range(repeat):
+        size = func()
+    elapsed = (time.perf_counter() - start) / repeat * 1000
+    print(f'{label:<44}{elapsed:>9.2f} ms{size:>12} bytes')
+
+
+def main():
+    repeat = int(sys.argv[1]) if len(sys.argv) > 1 else 10
+    bgra = synthetic_bgra()
+    pil_jpeg = get_encoder('jpeg')
+
+    print(f'Frame sintético {WIDTH}x{HEIGHT}, calidad {QUALITY}, {repeat} repeticiones')
+    bench('PIL: .rgb + frombytes + JPEG',
+          lambda: pil_jpeg.encode(legacy_rgb(bgra), QUALITY)['size'], repeat)
+    bench('PIL: frombuffer BGRX + JPEG',
+          lambda: pil_jpeg.encode(RawFrame(bgra, (WIDTH, HEIGHT)), QUALITY)['size'], repeat)
+
+    get_encoder('turbojpeg')
+    if 'turbojpeg' not in ENCODERS:
+        print('libjpeg-turbo no disponible (pip install PyTurboJPEG + libturbojpeg): '
+              'solo se mide la ruta PIL')
+        return
+
+    for subsampling in ('420', '444'):
+        for fast_dct in (True, False):
+            encoder = get_encoder('turbojpeg', subsampling, fast_dct)
+            bench(f'turbo BGRA {subsampling} {"fast DCT" if fast_dct else "DCT precisa"}',
+                  lambda: encoder.encode(RawFrame(bgra, (WIDTH, HEIGHT)), QUALITY)['size'], repeat)
+
+
+if __name__ == '__main__':
+    main()
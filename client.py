@@ -10,13 +10,27 @@ import os
 import platform
 from pathlib import Path
 import threading
+import time
 
 # Importar módulos locales
 from modules.system_info import SystemInfo
+from modules.process_monitor import ProcessSampler
 from modules.remote_control import RemoteControl
 from modules.file_transfer import FileTransfer
 from modules.web_restrictions import WebRestrictions
 from modules.network_control import NetworkControl
+from modules.screen_stream import (
+    TileDeltaEncoder, AdaptiveStreamController, ScreenStreamPipeline, FrameChangeDetector,
+    CaptureHub, RenditionCache
+)
+from modules.frame_encoders import (
+    FrameScaler, StripeEncoder, ENCODERS, get_encoder, encoder_stats, make_thumbnail
+)
+from modules.screen_capture import CaptureRegion, as_image
+from modules.stream_metrics import StageMetrics
+from modules.cursor_tracker import CursorStream
+from modules.flight_recorder import FlightRecorder, validate_recording_settings
+from modules.telemetry import TelemetryStream
 from client_gui import ClientGUI
 
 # Configuración de logging
@@ -31,6 +45,7 @@ sio = socketio.Client()
 
 # Instancias de módulos
 system_info = SystemInfo()
+process_sampler = ProcessSampler()
 remote_control = RemoteControl()
 file_transfer = FileTransfer()
 web_restrictions = WebRestrictions()
@@ -43,8 +58,40 @@ SERVER_URL = 'http://localhost:8080'
 # GUI
 gui = None
 
-# Control de streaming
-streaming_active = False
+# Control de streaming: {stream_id: {'pipeline', 'delta_encoder', 'monitor', 'region', 'base_id'}}
+screen_streams = {}
+
+# Latencias por etapa (capture, resize, encode, base64, emit); desactivadas por defecto,
+# se activan con 'stream_metrics_config' o con 'metrics' al iniciar un stream
+stream_metrics = StageMetrics()
+
+# Captura compartida: las sesiones que miran la misma área reciben el mismo grab,
+# y cada variante (escala/calidad/codificador) de un frame se codifica una sola vez
+capture_hub = CaptureHub(remote_control.capture_frame, stream_metrics)
+rendition_cache = RenditionCache()
+
+# Antigüedad máxima (s) de un frame reutilizado para 'request_screenshot' ('max_age' la cambia)
+SCREENSHOT_MAX_AGE = 0.5
+
+# Modo miniatura (muro de equipos): {'pipeline', 'settings', 'change_detector'}
+thumbnail_stream = None
+
+# Canal del cursor (posición a alta frecuencia, forma cacheada por hash)
+cursor_stream = None
+
+# Grabación continua en disco (opcional, la activa el servidor)
+flight_recorder = None
+
+# Telemetría push (instantánea + deltas) en lugar de sondeos 'request_system_info'
+telemetry_stream = None
+
+# Parte fija del registro (nombre, SO, usuario, capacidades, hash del inventario):
+# se construye una vez y cada reconexión solo añade IP y hora
+registration_info = None
+
+# Transporte binario: adjuntos binarios de socket.io en lugar de base64
+# (el servidor lo negocia con 'transport_config'; base64 queda como compatibilidad)
+binary_transport = False
 
 
 def get_client_id():
@@ -63,6 +110,83 @@ def get_client_id():
     return CLIENT_ID
 
 
+def pack_bytes(raw, binary=None):
+    """
+    Empaquetar bytes para enviarlos al servidor
+    
+    Args:
+        raw: Datos en bytes
+        binary: Forzar modo (None usa lo negociado con el servidor)
+        
+    Returns:
+        Tupla (datos, encoding) con bytes crudos o string base64
+    """
+    if binary is None:
+        binary = binary_transport
+    if binary:
+        return raw, 'binary'
+    return base64.b64encode(raw).decode('utf-8'), 'base64'
+
+
+def get_host_inventory():
+    """Inventario estático del equipo (CPU, RAM, discos, SO, MACs, monitores) y su hash"""
+    def list_monitors():
+        # Solo geometría: sondear el backend capturaría una pantalla (o arrancaría grim)
+        result = remote_control.get_monitors(probe=False)
+        return result['monitors'] if result.get('success') else []
+    
+    return system_info.get_host_inventory(list_monitors)
+
+
+def get_registration_info():
+    """Datos fijos del registro (se calculan una sola vez)"""
+    global registration_info
+    if registration_info is None:
+        import getpass
+        
+        _, inventory_hash = get_host_inventory()
+        registration_info = {
+            'name': platform.node(),  # Nombre de la PC
+            'os': f"{platform.system()} {platform.release()}",  # Sistema operativo
+            'user': getpass.getuser(),  # Usuario actual
+            'inventory_hash': inventory_hash,  # El inventario completo solo si el servidor no lo tiene
+            'capabilities': {
+                'binary_frames': True,
+                'delta_frames': True,
+                'stripe_frames': True,
+                'thumbnails': True,
+                'cursor_channel': True,
+                'flight_recorder': True,
+                'telemetry_push': True,
+                'top_processes': True,
+                'host_inventory': True,
+                'ip_tracking': True,
+                'encoders': sorted(ENCODERS)
+            }
+        }
+    return registration_info
+
+
+def send_host_inventory():
+    """Enviar el inventario completo (cuando el servidor no conoce el hash)"""
+    inventory, inventory_hash = get_host_inventory()
+    sio.emit('host_inventory', {
+        'client_id': get_client_id(),
+        'hash': inventory_hash,
+        'inventory': inventory
+    })
+    logger.info(f'🖥️  Inventario del equipo enviado (hash {inventory_hash})')
+
+
+def emit_ip_changed(change):
+    """Avisar al servidor de que cambió la IP (llamado desde el hilo de direcciones)"""
+    if sio.connected:
+        sio.emit('ip_changed', {
+            'client_id': get_client_id(),
+            **change
+        })
+
+
 # ============= Eventos de conexión =============
 
 @sio.event
@@ -75,16 +199,24 @@ def connect():
         gui.display_system_message("✅ Conectado al servidor")
     
     # Registrar cliente con el servidor
-    import getpass
     from datetime import datetime
     
     ip_address = system_info.get_ip_address()
     
+    # Telemetría en segundo plano: las consultas responden desde la caché
+    system_info.start_sampler()
+    
+    # IP por avisos del kernel: los cambios se envían como 'ip_changed'
+    system_info.address_tracker.on_change = emit_ip_changed
+    system_info.address_tracker.start()
+    
+    # Servidor nuevo o reiniciado: no tiene ninguna forma de cursor cacheada
+    if cursor_stream:
+        cursor_stream.sent_shapes.clear()
+    
     sio.emit('register_client', {
-        'name': platform.node(),  # Nombre de la PC
+        **get_registration_info(),
         'ip': ip_address,  # IP del cliente
-        'os': f"{platform.system()} {platform.release()}",  # Sistema operativo
-        'user': getpass.getuser(),  # Usuario actual
         'connected_at': datetime.now().isoformat()  # Timestamp
     })
 
@@ -97,6 +229,27 @@ def on_connected(data):
     logger.info(f'✅ Cliente registrado con ID: {CLIENT_ID}')
     if gui:
         gui.display_system_message(f"📋 ID asignado: {CLIENT_ID}")
+    
+    # El servidor indica si ya tiene el inventario de este hash
+    if data.get('inventory_known') is False:
+        send_host_inventory()
+
+
+@sio.on('request_host_inventory')
+def on_request_host_inventory(data=None):
+    """El servidor pide el inventario completo (no conoce el hash o lo perdió)"""
+    try:
+        send_host_inventory()
+    except Exception as e:
+        logger.error(f'Error enviando el inventario: {e}')
+
+
+@sio.on('transport_config')
+def on_transport_config(data):
+    """Servidor negocia el transporte de frames y archivos"""
+    global binary_transport
+    binary_transport = bool(data.get('binary', False))
+    logger.info(f'Transporte binario: {"activado" if binary_transport else "desactivado (base64)"}')
 
 
 @sio.event
@@ -129,16 +282,35 @@ def on_request_screenshot(data):
         
         quality = data.get('quality', 80)
         scale = data.get('scale', 1.0)
-        
-        # Capturar screenshot
-        screenshot_b64 = remote_control.capture_screenshot(quality, scale)
-        
-        if screenshot_b64:
+        binary = data.get('binary', binary_transport)
+        resample = data.get('resample', 'sharp')
+        monitor = data.get('monitor')
+        region = CaptureRegion.normalize(data['region']) if data.get('region') else None
+        encoder = get_encoder(data.get('encoder', 'jpeg-optimized'),
+                              subsampling=data.get('subsampling', '420'),
+                              fast_dct=data.get('fast_dct', True))
+        
+        # Frame reciente del área (el del stream si hay uno activo y es lo bastante nuevo);
+        # peticiones simultáneas comparten un único grab
+        frame, captured_at = capture_hub.latest(monitor, region, data.get('max_age', SCREENSHOT_MAX_AGE),
+                                                stage='screenshot.capture')
+        
+        # Solo se codifica si nadie pidió ya esta misma variante de este frame
+        rendition = ('screenshot', monitor, str(region), scale, resample, quality, encoder.name, binary)
+        screenshot = rendition_cache.get(rendition, frame, lambda: remote_control.capture_screenshot(
+            quality, scale, binary, resample, monitor, region, encoder, metrics=stream_metrics, frame=frame
+        ))
+        
+        if screenshot:
             # Enviar al servidor (el servidor sabe quién soy por request.sid)
-            sio.emit('screenshot_data', {
-                'screenshot': screenshot_b64,
-                'timestamp': system_info.get_system_stats().get('uptime')
-            })
+            payload = {
+                'screenshot': screenshot,
+                'monitor': monitor,
+                'captured_at': captured_at,
+                'timestamp': system_info.get_uptime()
+            }
+            with stream_metrics.time('screenshot.emit'):
+                sio.emit('screenshot_data', payload)
             logger.info('✅ Screenshot enviado al servidor')
         else:
             logger.error('❌ Error: Screenshot es None')
@@ -157,72 +329,654 @@ def on_request_screenshot(data):
 
 @sio.on('start_screen_stream')
 def on_start_screen_stream(data):
-    """Iniciar streaming de pantalla"""
-    import threading
-    import time
+    """
+    Iniciar streaming de pantalla (uno independiente por monitor o stream_id)
     
-    # Flag para controlar el streaming
-    global streaming_active
+    Solo un 'stream_id' explícito reemplaza a una sesión activa; sin él, una
+    petición para un monitor que ya se está enviando (p. ej. un segundo viewer)
+    abre otra sesión con un ID propio, que se comunica con 'screen_stream_started'.
+    """
+    monitor = data.get('monitor')
     
-    # Si ya está activo, no iniciar otro thread
-    if streaming_active:
-        logger.info('⚠️ Stream ya activo, ignorando solicitud duplicada')
+    # Región de interés: rectángulo o ventana X11 (vacía = pantalla completa,
+    # cambiable en caliente con 'update_stream_region'). Se valida antes de tocar
+    # cualquier sesión existente
+    try:
+        capture_region = CaptureRegion(data.get('region'), data.get('window_id'))
+    except (KeyError, TypeError, ValueError) as e:
+        logger.error(f'Región de stream inválida: {e}')
+        sio.emit('screen_stream_error', {'stream_id': data.get('stream_id'), 'error': str(e)})
         return
+    
+    base_id = None if data.get('stream_id') else get_stream_id(data)
+    stream_id = get_stream_id(data) if base_id is None else new_stream_id(base_id)
+    current = screen_streams.get(stream_id)
+    if current:
+        # ID explícito: la nueva solicitud reemplaza su configuración
+        if current['pipeline'].running:
+            logger.info(f'🔁 Stream {stream_id} ya activo, se reinicia con la nueva configuración')
+        current['pipeline'].stop()
+    has_region = data.get('region') or data.get('window_id') is not None
+    
+    fps = data.get('fps', 10)
+    quality = data.get('quality', 60)
+    # Una región se envía a tamaño real por defecto
+    scale = data.get('scale', 1.0 if has_region else 0.5)
+    binary = data.get('binary', binary_transport)
+    
+    # Escalado con geometría cacheada ('fast', 'balanced', 'sharp')
+    scaler = FrameScaler(scale, data.get('resample', 'balanced'))
+    
+    # Codificador elegido por el servidor ('jpeg', 'turbojpeg', 'webp', 'png-palette', 'auto', ...)
+    encoder = get_encoder(data.get('encoder', 'jpeg'),
+                          subsampling=data.get('subsampling', '420'),
+                          fast_dct=data.get('fast_dct', True))
+    
+    # Modo delta: solo se envían los tiles que cambiaron
+    delta_mode = data.get('delta', False)
+    delta_encoder = None
+    if delta_mode:
+        delta_encoder = TileDeltaEncoder(
+            tile_size=data.get('tile_size', 64),
+            keyframe_interval=data.get('keyframe_interval', 10.0),
+            encoder=encoder.name
+        )
+    
+    # Franjas en paralelo para frames grandes (4K, ultrawide): número o 'auto'
+    stripe_encoder = None
+    if not delta_mode and data.get('stripes'):
+        stripe_encoder = StripeEncoder(encoder, data['stripes'])
+    
+    # Modo adaptativo: el servidor da los límites y confirma cada frame (ack)
+    controller = None
+    if data.get('adaptive', False):
+        controller = AdaptiveStreamController(
+            quality, scale, fps,
+            bounds=data.get('bounds'),
+            target_latency_ms=data.get('target_latency_ms', 250)
+        )
+        fps = controller.fps
+    
+    subscriber = f'stream:{stream_id}'
+    last_token = None
+    
+    def capture_stage():
+        nonlocal last_token
+        if controller:
+            controller.update()
+            pipeline.fps = controller.fps
+        # Frame del bucle de captura compartido (otras sesiones pueden recibir el mismo)
+        last_token, frame = capture_hub.next_frame(
+            subscriber, pipeline.fps, monitor, capture_region.resolve(), last_token,
+            timeout=max(1.0, 2.0 / pipeline.fps)
+        )
+        return frame
+    
+    def encode_stage(frame):
+        frame_quality, frame_scale = quality, scale
+        if controller:
+            frame_quality, frame_scale = controller.quality, controller.scale
+        
+        def produce():
+            if frame_scale == 1.0 and delta_encoder is None and encoder.accepts_raw:
+                # Buffer BGRA directo al codificador (libjpeg-turbo), sin pasar por PIL
+                img = frame
+            else:
+                with stream_metrics.time('resize'):
+                    img = scaler(as_image(frame), frame_scale)
+            return encode_stream_frame(img, frame_quality, binary, delta_encoder, encoder, stripe_encoder)
+        
+        start = time.perf_counter()
+        if delta_encoder is None:
+            # Sesiones con la misma variante comparten la codificación del frame
+            rendition = (monitor, str(capture_region.describe()), frame_scale, scaler.resample,
+                         frame_quality, encoder.name, stripe_encoder and stripe_encoder.stripes, binary)
+            encoded = rendition_cache.get(rendition, frame, produce)
+        else:
+            # El estado delta es propio de cada viewer
+            encoded = produce()
+        if encoded is None:
+            return None
+        event, payload, size = encoded
+        return {
+            'event': event,
+            'payload': payload,
+            'size': size,
+            'encode_ms': (time.perf_counter() - start) * 1000
+        }
+    
+    def send_stage(frame):
+        seq = pipeline.frames_sent
+        # Copia: el payload codificado puede estar compartido con otras sesiones
+        payload = dict(frame['payload'])
+        payload['seq'] = seq
+        payload['stream_id'] = stream_id
+        payload['monitor'] = monitor
+        region = capture_region.describe()
+        if region['rect'] or region['window_id']:
+            payload['region'] = region
+        callback = None
+        if controller:
+            payload['settings'] = controller.settings()
+            callback = lambda *args: controller.frame_acked(seq)
+            controller.frame_sent(seq, frame['size'], frame['encode_ms'])
+        
+        # El servidor usará request.sid como client_id
+        with stream_metrics.time('emit'):
+            sio.emit(frame['event'], payload, callback=callback)
+        if (seq + 1) % 30 == 0:  # Log y estadísticas cada 30 frames
+            stats = pipeline.stats()
+            stats['stream_id'] = stream_id
+            stats['encoders'] = encoder_stats()
+            stats['capture'] = capture_hub.stats()
+            stats['renditions'] = rendition_cache.stats()
+            if stream_metrics.enabled:
+                stats['latency'] = stream_metrics.snapshot()['stages']
+            logger.info(f'📡 [{stream_id}] Frames enviados: {seq + 1} - FPS reales: {stats["achieved_fps"]}/{stats["target_fps"]}, '
+                        f'jitter: {stats["jitter_ms"]} ms, saltados: {stats["skipped_deadlines"]}, '
+                        f'sin cambios: {stats["frames_unchanged"]}')
+            sio.emit('stream_stats', stats)
+    
+    def keepalive():
+        # Pantalla sin cambios: aviso mínimo para que el viewer sepa que seguimos vivos
+        sio.emit('screen_keepalive', {
+            'stream_id': stream_id,
+            'frames_sent': pipeline.frames_sent,
+            'frames_unchanged': pipeline.frames_unchanged
+        })
+    
+    if data.get('metrics'):
+        stream_metrics.enabled = True
+    
+    # Saltar frames idénticos antes de codificar (activado por defecto)
+    change_detector = FrameChangeDetector() if data.get('skip_unchanged', True) else None
+    
+    pipeline = ScreenStreamPipeline(
+        capture_stage, encode_stage, send_stage, fps,
+        change_detector=change_detector,
+        keepalive=keepalive,
+        keepalive_interval=data.get('keepalive_interval', 2.0),
+        lossless_send=delta_encoder is not None
+    )
+    screen_streams[stream_id] = {
+        'pipeline': pipeline,
+        'delta_encoder': delta_encoder,
+        'monitor': monitor,
+        'region': capture_region,
+        'base_id': base_id
+    }
+    sio.emit('screen_stream_started', {'stream_id': stream_id, 'monitor': monitor})
+    
+    logger.info(f'🎥 Iniciando stream de pantalla [{stream_id}] - Monitor: {monitor}, FPS: {fps}, Quality: {quality}, Scale: {scale} ({scaler.resample}), Encoder: {encoder.name}, Delta: {delta_mode}, Franjas: {stripe_encoder.stripes if stripe_encoder else None}, Adaptativo: {controller is not None}')
+    pipeline.start()
+
 
-    streaming_active = True
+def get_stream_id(data):
+    """ID del stream: explícito, o derivado del monitor pedido"""
+    if data.get('stream_id'):
+        return str(data['stream_id'])
+    monitor = data.get('monitor')
+    return 'default' if monitor is None else f'monitor-{monitor}'
+
+
+def new_stream_id(base_id):
+    """ID libre para una sesión sin ID explícito: 'monitor-1', 'monitor-1#2', ..."""
+    stream_id, n = base_id, 1
+    while stream_id in screen_streams and screen_streams[stream_id]['pipeline'].running:
+        n += 1
+        stream_id = f'{base_id}#{n}'
+    return stream_id
+
+
+def encode_stream_frame(img, quality, binary=None, delta_encoder=None, encoder=None, stripe_encoder=None):
+    """
+    Codificar un frame del stream
     
-    def stream_screen():
-        global streaming_active
-        fps = data.get('fps', 10)
-        quality = data.get('quality', 60)
-        scale = data.get('scale', 0.5)
-        interval = 1.0 / fps
-        
-        logger.info(f'🎥 Iniciando stream de pantalla - FPS: {fps}, Quality: {quality}, Scale: {scale}')
-        
-        frame_count = 0
-        while streaming_active:
-            try:
-                screenshot_b64 = remote_control.capture_screenshot(quality, scale)
-                
-                if screenshot_b64:
-                    # El servidor usará request.sid como client_id
-                    sio.emit('screen_frame', {
-                        'frame': screenshot_b64
-                    })
-                    frame_count += 1
-                    if frame_count % 30 == 0:  # Log cada 30 frames
-                        logger.info(f'📡 Frames enviados: {frame_count}')
-                else:
-                    logger.warning('⚠️  Screenshot es None en el stream')
-                
-                time.sleep(interval)
-                
-            except Exception as e:
-                logger.error(f'❌ Error en stream: {e}')
-                # Si es un error fatal de X11/Wayland, detener el stream para evitar crash loop
-                if "BadMatch" in str(e) or "X_GetImage" in str(e):
-                    logger.critical("Error fatal de gráficos detectado. Deteniendo stream.")
-                    streaming_active = False
-                    break
-                import traceback
-                logger.error(traceback.format_exc())
-                time.sleep(1) # Esperar un poco antes de reintentar
-        
-        logger.info(f'⏹️  Stream detenido. Total de frames: {frame_count}')
-        streaming_active = False # Asegurar flag apagado al salir
+    Args:
+        img: Imagen PIL ya escalada
+        quality: Calidad de imagen
+        binary: Forzar transporte binario (None usa lo negociado)
+        delta_encoder: TileDeltaEncoder si el stream está en modo delta
+        encoder: FrameEncoder para frames completos (JPEG por defecto)
+        stripe_encoder: StripeEncoder para dividir frames grandes en franjas
+    
+    Returns:
+        Tupla (evento, payload, bytes de imagen) o None si no hay nada que enviar
+    """
+    if binary is None:
+        binary = binary_transport
+    # La etapa 'base64' solo se mide si hay conversión (los adjuntos binarios no cuestan)
+    pack_stage = None if binary else 'base64'
+    
+    if delta_encoder is None and stripe_encoder and stripe_encoder.stripe_count(img.size) > 1:
+        with stream_metrics.time('encode'):
+            packet = stripe_encoder.encode(img, quality)
+        with stream_metrics.time(pack_stage):
+            for stripe in packet['stripes']:
+                stripe['data'], encoding = pack_bytes(stripe['data'], binary)
+        payload = {
+            'frame': {
+                'width': img.width,
+                'height': img.height,
+                'format': packet['format'],
+                'encoder': packet['encoder'],
+                'encoding': encoding,
+                'stripes': packet['stripes'],
+                'encode_ms': round(packet['encode_ms'], 2)
+            }
+        }
+        return 'screen_frame_stripes', payload, packet['size']
+    
+    if delta_encoder is None:
+        with stream_metrics.time('encode'):
+            encoded = (encoder or get_encoder()).encode(img, quality)
+        keyframe = False
+    else:
+        with stream_metrics.time('encode'):
+            packet = delta_encoder.encode(img, quality)
+        
+        if packet['type'] == 'delta':
+            if not packet['tiles']:
+                return None
+            
+            size = 0
+            with stream_metrics.time(pack_stage):
+                for tile in packet['tiles']:
+                    size += len(tile['data'])
+                    tile['data'], encoding = pack_bytes(tile['data'], binary)
+            packet['encoding'] = encoding
+            return 'screen_frame_delta', packet, size
+        
+        encoded = {'data': packet['data'], 'format': packet['format'],
+                   'encoder': delta_encoder.encoder.name}
+        keyframe = True
     
-    # Ejecutar en thread separado
-    thread = threading.Thread(target=stream_screen, daemon=True)
-    thread.start()
+    # Frame completo (o keyframe con el mismo formato que un frame normal)
+    with stream_metrics.time(pack_stage):
+        frame_data, encoding = pack_bytes(encoded['data'], binary)
+    payload = {
+        'frame': {
+            'data': frame_data,
+            'width': img.width,
+            'height': img.height,
+            'format': encoded['format'],
+            'encoder': encoded['encoder'],
+            'encoding': encoding
+        }
+    }
+    if 'encode_ms' in encoded:
+        payload['frame']['encode_ms'] = round(encoded['encode_ms'], 2)
+    if keyframe:
+        payload['keyframe'] = True
+    return 'screen_frame', payload, len(encoded['data'])
+
+
+def selected_streams(data):
+    """Streams a los que aplica una petición: el indicado, los de un monitor o todos"""
+    if data and data.get('stream_id'):
+        stream = screen_streams.get(str(data['stream_id']))
+        return [stream] if stream else []
+    if data and data.get('monitor') is not None:
+        # Todas las sesiones sin ID explícito abiertas para ese monitor
+        base_id = get_stream_id(data)
+        return [stream for stream_id, stream in screen_streams.items()
+                if stream_id == base_id or stream['base_id'] == base_id]
+    return list(screen_streams.values())
+
+
+@sio.on('request_keyframe')
+def on_request_keyframe(data):
+    """Un nuevo viewer necesita un frame completo para sincronizarse"""
+    for stream in selected_streams(data):
+        pipeline = stream['pipeline']
+        if pipeline.change_detector:
+            # El siguiente frame debe salir aunque la pantalla no haya cambiado
+            pipeline.change_detector.reset()
+        if stream['delta_encoder']:
+            stream['delta_encoder'].request_keyframe()
+            logger.info('🔑 Keyframe solicitado por el servidor')
+
+
+@sio.on('update_stream_region')
+def on_update_stream_region(data):
+    """Cambiar la región de interés de un stream sin reiniciarlo"""
+    for stream in selected_streams(data):
+        try:
+            stream['region'].update(data.get('region'), data.get('window_id'))
+            logger.info(f'🔲 Región de stream actualizada: {stream["region"].describe()}')
+        except (KeyError, TypeError, ValueError) as e:
+            logger.error(f'Región de stream inválida: {e}')
 
 
 @sio.on('stop_screen_stream')
 def on_stop_screen_stream(data):
-    """Detener streaming de pantalla"""
-    global streaming_active
-    streaming_active = False
+    """Detener streaming de pantalla (uno concreto o todos)"""
     logger.info('⏹️  Deteniendo stream de pantalla...')
+    for stream_id, stream in list(screen_streams.items()):
+        if stream not in selected_streams(data):
+            continue
+        pipeline = stream['pipeline']
+        if pipeline.running:
+            pipeline.stop()
+            logger.info(f'⏹️  Stream {stream_id} detenido. Total de frames: {pipeline.frames_sent} '
+                        f'(sin cambios: {pipeline.frames_unchanged}, '
+                        f'descartados por backpressure: {pipeline.frames_dropped})')
+            stats = pipeline.stats()
+            stats['stream_id'] = stream_id
+            if stream_metrics.enabled:
+                stats['latency'] = stream_metrics.snapshot()['stages']
+            sio.emit('stream_stats', stats)
+        capture_hub.unsubscribe(f'stream:{stream_id}')
+        del screen_streams[stream_id]
+
+
+@sio.on('stream_metrics_config')
+def on_stream_metrics_config(data):
+    """Activar/desactivar la medición de latencias por etapa"""
+    data = data or {}
+    if data.get('reset'):
+        stream_metrics.reset()
+    if 'enabled' in data:
+        stream_metrics.enabled = bool(data['enabled'])
+    logger.info(f'⏱️ Métricas de latencia {"activadas" if stream_metrics.enabled else "desactivadas"}')
+
+
+@sio.on('request_stream_metrics')
+def on_request_stream_metrics(data=None):
+    """Volcado bajo demanda de los percentiles por etapa"""
+    snapshot = stream_metrics.snapshot()
+    snapshot['capture'] = capture_hub.stats()
+    snapshot['renditions'] = rendition_cache.stats()
+    sio.emit('stream_metrics', snapshot)
+
+
+@sio.on('start_thumbnail_stream')
+def on_start_thumbnail_stream(data):
+    """Miniaturas pequeñas a baja cadencia, enviadas solo cuando cambian"""
+    global thumbnail_stream
+    data = data or {}
+    
+    if thumbnail_stream and thumbnail_stream['pipeline'].running:
+        # Ya activo: aplicar la nueva configuración en caliente
+        on_update_thumbnail_stream(data)
+        return
+    
+    settings = {
+        'width': data.get('width', 240),
+        'quality': data.get('quality', 40),
+        'monitor': data.get('monitor')
+    }
+    encoder = get_encoder(data.get('encoder', 'jpeg'))
+    binary = data.get('binary', binary_transport)
+    
+    last_token = None
+    
+    def capture_stage():
+        nonlocal last_token
+        # Mismo grab que los streams del monitor (si hay alguno activo)
+        last_token, frame = capture_hub.next_frame('thumbnail', pipeline.fps, settings['monitor'],
+                                                   last=last_token, timeout=max(1.0, 2.0 / pipeline.fps))
+        if frame is None:
+            return None
+        # Se reduce ya aquí: la detección de cambios compara miniaturas
+        return make_thumbnail(as_image(frame), settings['width'])
+    
+    def encode_stage(thumbnail):
+        encoded = encoder.encode(thumbnail, settings['quality'])
+        thumbnail_data, encoding = pack_bytes(encoded['data'], binary)
+        return {
+            'thumbnail': {
+                'data': thumbnail_data,
+                'width': thumbnail.width,
+                'height': thumbnail.height,
+                'format': encoded['format'],
+                'encoding': encoding
+            }
+        }
+    
+    def send_stage(payload):
+        payload['seq'] = pipeline.frames_sent
+        payload['monitor'] = settings['monitor']
+        payload['timestamp'] = time.time()
+        sio.emit('screen_thumbnail', payload)
+    
+    change_detector = FrameChangeDetector(sample_factor=1)
+    pipeline = ScreenStreamPipeline(
+        capture_stage, encode_stage, send_stage,
+        fps=min(data.get('fps', 0.5), 2),
+        change_detector=change_detector
+    )
+    thumbnail_stream = {
+        'pipeline': pipeline,
+        'settings': settings,
+        'change_detector': change_detector
+    }
+    
+    logger.info(f'🖼️ Iniciando miniaturas - Ancho: {settings["width"]}, FPS: {pipeline.fps}, Quality: {settings["quality"]}')
+    pipeline.start()
+
+
+@sio.on('update_thumbnail_stream')
+def on_update_thumbnail_stream(data):
+    """El servidor ajusta la cadencia o el tamaño de las miniaturas"""
+    if not thumbnail_stream or not data:
+        return
+    
+    settings = thumbnail_stream['settings']
+    for key in ('width', 'quality', 'monitor'):
+        if key in data:
+            settings[key] = data[key]
+    if 'fps' in data:
+        thumbnail_stream['pipeline'].fps = min(data['fps'], 2)
+    
+    # Enviar una miniatura con la nueva configuración aunque la pantalla no cambie
+    thumbnail_stream['change_detector'].reset()
+    logger.info(f'🖼️ Miniaturas actualizadas - Ancho: {settings["width"]}, FPS: {thumbnail_stream["pipeline"].fps}')
+
+
+@sio.on('stop_thumbnail_stream')
+def on_stop_thumbnail_stream(data=None):
+    """Detener las miniaturas"""
+    global thumbnail_stream
+    if not thumbnail_stream:
+        return
+    
+    pipeline = thumbnail_stream['pipeline']
+    pipeline.stop()
+    capture_hub.unsubscribe('thumbnail')
+    logger.info(f'⏹️  Miniaturas detenidas. Enviadas: {pipeline.frames_sent} (sin cambios: {pipeline.frames_unchanged})')
+    thumbnail_stream = None
+
+
+def emit_cursor(event, payload):
+    """Emitir un evento del canal del cursor (la imagen de la forma va como PNG)"""
+    if 'data' in payload:
+        payload['data'], payload['encoding'] = pack_bytes(payload['data'])
+    sio.emit(event, payload)
+
+
+@sio.on('start_cursor_stream')
+def on_start_cursor_stream(data):
+    """Enviar posición y forma del cursor separadas del stream de píxeles"""
+    global cursor_stream
+    data = data or {}
+    rate = data.get('rate', 30)
+    
+    if cursor_stream and cursor_stream.running:
+        cursor_stream.rate = rate
+        logger.info(f'🖱️ Canal del cursor ya activo, frecuencia: {rate} Hz')
+        return
+    
+    cursor_stream = CursorStream(emit_cursor, rate=rate, shape_interval=data.get('shape_interval', 0.1))
+    if cursor_stream.start():
+        logger.info(f'🖱️ Canal del cursor iniciado a {rate} Hz')
+    else:
+        cursor_stream = None
+        sio.emit('cursor_error', {'error': 'No se puede leer el cursor en esta sesión'})
+
+
+@sio.on('request_cursor_shape')
+def on_request_cursor_shape(data):
+    """El servidor perdió una forma de su caché y la pide por hash"""
+    if not cursor_stream or not data:
+        return
+    if not cursor_stream.send_shape(data.get('hash')):
+        sio.emit('cursor_error', {'error': 'Forma de cursor no disponible', 'hash': data.get('hash')})
+
+
+@sio.on('stop_cursor_stream')
+def on_stop_cursor_stream(data=None):
+    """Detener el canal del cursor"""
+    global cursor_stream
+    if not cursor_stream:
+        return
+    cursor_stream.stop()
+    logger.info(f'⏹️  Canal del cursor detenido. Actualizaciones enviadas: {cursor_stream.updates_sent}')
+    cursor_stream = None
+
+
+@sio.on('start_recording')
+def on_start_recording(data):
+    """Activar la grabación continua en el archivo circular"""
+    global flight_recorder
+    data = data or {}
+    if flight_recorder and flight_recorder.running:
+        logger.info('⚠️ Grabación ya activa')
+        sio.emit('recording_status', flight_recorder.status())
+        return
+    if data.get('path'):
+        # El archivo siempre va a la carpeta de grabaciones del agente
+        logger.warning(f'⚠️ Ruta de grabación rechazada: {data["path"]}')
+        sio.emit('recording_error', {'error': "Solo se acepta 'name' (nombre de archivo), no 'path'"})
+        return
+    previous_ring = flight_recorder.ring if flight_recorder else None
+    
+    # fps llega a divisiones (timeout de captura) y size_mb al tamaño del archivo en disco
+    try:
+        fps, size_mb = validate_recording_settings(data.get('fps', 0.5), data.get('size_mb', 64))
+    except ValueError as e:
+        logger.error(f'❌ Parámetros de grabación no válidos: {e}')
+        sio.emit('recording_error', {'error': str(e)})
+        return
+    
+    monitor = data.get('monitor')
+    last_token = None
+    
+    def capture():
+        nonlocal last_token
+        # Comparte el grab con los streams del mismo monitor
+        last_token, frame = capture_hub.next_frame('recorder', fps, monitor, last=last_token,
+                                                   timeout=max(1.0, 2.0 / fps))
+        return frame
+    
+    try:
+        recorder = FlightRecorder(
+            capture,
+            name=data.get('name', 'flight_recorder'),
+            size_mb=size_mb,
+            fps=fps,
+            scale=data.get('scale', 0.5),
+            quality=data.get('quality', 40),
+            ring=previous_ring
+        )
+    except (OSError, ValueError) as e:
+        logger.error(f'❌ No se pudo abrir el archivo de grabación: {e}')
+        sio.emit('recording_error', {'error': str(e)})
+        return
+    
+    # El archivo anterior se cierra si no se reutiliza (después de los envíos en curso)
+    if previous_ring is not None and previous_ring is not recorder.ring:
+        previous_ring.close()
+    flight_recorder = recorder
+    
+    flight_recorder.start()
+    logger.info(f'⏺️ Grabación continua iniciada - FPS: {fps}, Tamaño: {size_mb} MB')
+    sio.emit('recording_status', flight_recorder.status())
+
+
+@sio.on('stop_recording')
+def on_stop_recording(data=None):
+    """Detener la grabación (lo grabado sigue disponible)"""
+    if not flight_recorder or not flight_recorder.running:
+        return
+    flight_recorder.stop()
+    capture_hub.unsubscribe('recorder')
+    logger.info('⏹️  Grabación continua detenida')
+    sio.emit('recording_status', flight_recorder.status())
+
+
+@sio.on('request_recording')
+def on_request_recording(data):
+    """
+    Enviar los frames grabados de un rango de tiempo
+    
+    Acepta 'start'/'end' (epoch) o 'last' (segundos hasta ahora).
+    """
+    data = data or {}
+    if not flight_recorder:
+        sio.emit('recording_error', {'error': 'La grabación no está activa'})
+        return
+    
+    if data.get('last'):
+        start, end = time.time() - data['last'], None
+    else:
+        start, end = data.get('start'), data.get('end')
+    request_id = data.get('request_id')
+    binary = data.get('binary', binary_transport)
+    
+    # El archivo de esta grabación, aunque luego se inicie otra
+    ring = flight_recorder.ring
+    
+    def send_frames():
+        sent = 0
+        try:
+            with ring.reading():
+                entries = ring.index(start, end)
+                logger.info(f'⏪ Enviando grabación: {len(entries)} frames')
+                for entry in entries:
+                    frame_data = ring.read(entry)
+                    if frame_data is None:
+                        continue  # Sobrescrito mientras se enviaba
+                    frame_data, encoding = pack_bytes(frame_data, binary)
+                    sio.emit('recording_frame', {
+                        'request_id': request_id,
+                        'index': sent,
+                        'total': len(entries),
+                        'timestamp': entry.timestamp,
+                        'width': entry.width,
+                        'height': entry.height,
+                        'format': entry.format,
+                        'encoding': encoding,
+                        'data': frame_data
+                    })
+                    sent += 1
+        except ValueError as e:
+            logger.error(f'❌ Error leyendo la grabación: {e}')
+        sio.emit('recording_complete', {'request_id': request_id, 'frames': sent})
+    
+    # En segundo plano: no bloquear el resto de eventos mientras se envía
+    threading.Thread(target=send_frames, name='recording-sender', daemon=True).start()
+
+
+@sio.on('request_recording_status')
+def on_request_recording_status(data=None):
+    """Rango de tiempo disponible y ocupación del archivo"""
+    if not flight_recorder:
+        sio.emit('recording_status', {'recording': False, 'frames': 0})
+        return
+    sio.emit('recording_status', flight_recorder.status())
+
+
+@sio.on('request_monitors')
+def on_request_monitors(data):
+    """Enumerar la geometría de los monitores"""
+    result = remote_control.get_monitors(refresh=data.get('refresh', False) if data else False)
+    sio.emit('monitors_info', {
+        'client_id': get_client_id(),
+        **result
+    })
+    if result.get('success'):
+        logger.info(f'Monitores enviados: {max(0, len(result["monitors"]) - 1)}')
 
 
 @sio.on('lock_keyboard')
@@ -451,6 +1205,73 @@ def on_request_system_info(data):
         logger.error(f'Error obteniendo info del sistema: {e}')
 
 
+@sio.on('request_top_processes')
+def on_request_top_processes(data):
+    """Enviar los procesos que más CPU, memoria o E/S consumen"""
+    data = data or {}
+    
+    def send_top():
+        try:
+            result = process_sampler.top(n=data.get('n', 10), sort_by=data.get('sort_by', 'cpu'))
+            sio.emit('top_processes', {
+                'client_id': get_client_id(),
+                **result
+            })
+            logger.info(f'Top de procesos enviado ({result["sort_by"]}, tick: {result["tick_ms"]} ms)')
+        except Exception as e:
+            logger.error(f'Error obteniendo procesos: {e}')
+            sio.emit('top_processes', {'client_id': get_client_id(), 'error': str(e)})
+    
+    # La primera consulta espera a la segunda lectura de CPU: no bloquear otros eventos
+    threading.Thread(target=send_top, name='top-processes', daemon=True).start()
+
+
+@sio.on('subscribe_telemetry')
+def on_subscribe_telemetry(data):
+    """
+    Enviar telemetría periódicamente sin que el servidor la pida
+    
+    El primer mensaje 'telemetry' es una instantánea completa ('data' y 'system');
+    los siguientes solo llevan los cambios sobre las claves aplanadas con puntos:
+    'delta' (sumar al valor numérico), 'set' (valor nuevo) y 'unset' (clave eliminada).
+    """
+    global telemetry_stream
+    data = data or {}
+    if telemetry_stream:
+        telemetry_stream.stop()
+    
+    def emit_telemetry(message):
+        message['client_id'] = get_client_id()
+        sio.emit('telemetry', message)
+    
+    telemetry_stream = TelemetryStream(
+        system_info, emit_telemetry,
+        interval=data.get('interval', 5.0),
+        keyframe_interval=data.get('keyframe_interval', 60.0)
+    )
+    telemetry_stream.start()
+    logger.info(f'📊 Telemetría push activada cada {telemetry_stream.interval} s')
+
+
+@sio.on('request_telemetry_snapshot')
+def on_request_telemetry_snapshot(data=None):
+    """El servidor perdió el estado: la próxima telemetría será una instantánea completa"""
+    if telemetry_stream:
+        telemetry_stream.encoder.request_keyframe()
+
+
+@sio.on('unsubscribe_telemetry')
+def on_unsubscribe_telemetry(data=None):
+    """Detener la telemetría push"""
+    global telemetry_stream
+    if not telemetry_stream:
+        return
+    telemetry_stream.stop()
+    logger.info(f'📊 Telemetría push detenida. Mensajes: {telemetry_stream.messages_sent} '
+                f'(sin cambios: {telemetry_stream.messages_skipped})')
+    telemetry_stream = None
+
+
 # ============= Transferencia de archivos =============
 
 @sio.on('request_file_transfer')
@@ -462,11 +1283,11 @@ def on_request_file_transfer(data):
         
         if direction == 'download':
             # Servidor quiere descargar archivo de este cliente
-            file_data = file_transfer.read_file(filename, get_client_id())
+            file_info = file_transfer.read_file(filename, get_client_id(), encode=False)
             
-            if file_data:
+            if file_info.get('success'):
                 # Enviar en chunks
-                chunks = file_transfer.split_file_chunks(file_data)
+                chunks = file_transfer.split_file_chunks(file_info['data'], binary=binary_transport)
                 total_chunks = len(chunks)
                 
                 for i, chunk in enumerate(chunks):
@@ -475,7 +1296,8 @@ def on_request_file_transfer(data):
                         'filename': filename,
                         'chunk_index': i,
                         'total_chunks': total_chunks,
-                        'data': chunk
+                        'data': chunk,
+                        'encoding': 'binary' if binary_transport else 'base64'
                     })
                 
                 logger.info(f'Archivo enviado: {filename} ({total_chunks} chunks)')
@@ -541,12 +1363,12 @@ def on_request_file_from_client(data):
             })
             return
         
-        # Leer archivo y convertir a base64
+        # Leer archivo (bytes crudos o base64 según el transporte)
         try:
             with open(file_path, 'rb') as f:
                 file_bytes = f.read()
             
-            file_data = base64.b64encode(file_bytes).decode('utf-8')
+            file_data, encoding = pack_bytes(file_bytes)
             filename = os.path.basename(file_path)
             
             # Enviar al servidor
@@ -554,7 +1376,8 @@ def on_request_file_from_client(data):
                 'client_id': get_client_id(),
                 'transfer_id': transfer_id,
                 'filename': filename,
-                'file_data': file_data
+                'file_data': file_data,
+                'encoding': encoding
             })
             
             logger.info(f'✅ Archivo enviado al servidor: {filename} ({len(file_bytes)} bytes)')
@@ -634,18 +1457,19 @@ def send_file_to_server_func(file_path):
             logger.error(f'Archivo no encontrado: {file_path}')
             return False
         
-        # Leer archivo y convertir a base64
+        # Leer archivo (bytes crudos o base64 según el transporte)
         with open(file_path, 'rb') as f:
             file_bytes = f.read()
         
-        file_data = base64.b64encode(file_bytes).decode('utf-8')
+        file_data, encoding = pack_bytes(file_bytes)
         filename = os.path.basename(file_path)
         
         # Enviar al servidor
         sio.emit('client_send_file', {
             'client_id': get_client_id(),
             'filename': filename,
-            'file_data': file_data
+            'file_data': file_data,
+            'encoding': encoding
         })
         
         logger.info(f'✅ Archivo enviado al servidor: {filename} ({len(file_bytes)} bytes)')
@@ -797,6 +1621,8 @@ def main():
         # Conectar al servidor en un thread separado
         def connect_to_server():
             try:
+                # Inventario una sola vez al arrancar: las reconexiones solo mandan el hash
+                get_registration_info()
                 sio.connect(server_url)
                 sio.wait()
             except Exception as e:
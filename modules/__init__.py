@@ -4,6 +4,7 @@ Módulos del backend de monitoreo
 
 from .system_info import SystemInfo
 from .remote_control import RemoteControl
+from .screen_capture import CaptureBackend
 from .file_transfer import FileTransfer
 from .chat import ChatManager
 from .web_restrictions import WebRestrictions
@@ -12,6 +13,7 @@ from .network_control import NetworkControl
 __all__ = [
     'SystemInfo',
     'RemoteControl',
+    'CaptureBackend',
     'FileTransfer',
     'ChatManager',
     'WebRestrictions',
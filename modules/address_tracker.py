@@ -0,0 +1,210 @@
+"""
+Módulo de seguimiento de direcciones IP
+Lee las direcciones de las interfaces con psutil y solo las vuelve a leer cuando el
+kernel avisa de un cambio (netlink) o, sin netlink, con un diff periódico barato
+"""
+import socket
+import select
+import logging
+import threading
+import ipaddress
+
+import psutil
+
+logger = logging.getLogger(__name__)
+
+# Grupos multicast de rtnetlink: enlaces, direcciones IPv4/IPv6 y rutas IPv4
+RTMGRP_LINK = 0x1
+RTMGRP_IPV4_IFADDR = 0x10
+RTMGRP_IPV4_ROUTE = 0x40
+RTMGRP_IPV6_IFADDR = 0x100
+
+FALLBACK_IP = '127.0.0.1'
+
+
+class AddressTracker:
+    """Dirección IP principal cacheada; se actualiza por eventos del kernel"""
+
+    # Tras un aviso de netlink se esperan los siguientes (DHCP manda varios seguidos)
+    DEBOUNCE = 0.3
+
+    def __init__(self, on_change=None, poll_interval=10.0, netlink_poll_interval=300.0):
+        """
+        Inicializar seguimiento
+
+        Args:
+            on_change: Función on_change(cambio) llamada desde el hilo cuando cambian las
+                       direcciones; recibe un dict con 'ip', 'previous_ip' y 'addresses'
+            poll_interval: Segundos entre diffs periódicos cuando no hay netlink
+            netlink_poll_interval: Diff de seguridad con netlink activo
+        """
+        self.on_change = on_change
+        self.poll_interval = poll_interval
+        self.netlink_poll_interval = netlink_poll_interval
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._ip = None
+        self._addresses = {}
+        self.mode = None
+        self.changes = 0
+
+    @staticmethod
+    def read_addresses():
+        """
+        Direcciones IPv4 de las interfaces activas
+
+        Returns:
+            Dict {interfaz: [ip, ...]} ordenado por interfaz
+        """
+        stats = psutil.net_if_stats()
+        addresses = {}
+        for interface, entries in psutil.net_if_addrs().items():
+            if interface in stats and not stats[interface].isup:
+                continue
+            ips = [entry.address for entry in entries if entry.family == socket.AF_INET]
+            if ips:
+                addresses[interface] = ips
+        return dict(sorted(addresses.items()))
+
+    @staticmethod
+    def _default_interface():
+        """Interfaz de la ruta por defecto con menor métrica (Linux); None si no se sabe"""
+        try:
+            with open('/proc/net/route') as routes:
+                next(routes)
+                best = None
+                for line in routes:
+                    fields = line.split()
+                    # Destino 0.0.0.0 con la ruta activa (RTF_UP)
+                    if len(fields) > 6 and fields[1] == '00000000' and int(fields[3], 16) & 1:
+                        metric = int(fields[6])
+                        if best is None or metric < best[0]:
+                            best = (metric, fields[0])
+                return best[1] if best else None
+        except (OSError, StopIteration, ValueError):
+            return None
+
+    @classmethod
+    def pick_primary(cls, addresses):
+        """
+        Elegir la dirección con la que el equipo sale a la red
+
+        Args:
+            addresses: Dict {interfaz: [ip, ...]}
+
+        Returns:
+            IP de la interfaz de la ruta por defecto; si no la hay, la primera dirección
+            que no sea loopback ni link-local; '127.0.0.1' si no hay ninguna
+        """
+        default = cls._default_interface()
+        if default in addresses:
+            return addresses[default][0]
+        for ips in addresses.values():
+            for ip in ips:
+                parsed = ipaddress.ip_address(ip)
+                if not (parsed.is_loopback or parsed.is_link_local):
+                    return ip
+        return FALLBACK_IP
+
+    @property
+    def ip(self):
+        """IP principal cacheada (la primera consulta lee las interfaces)"""
+        with self._lock:
+            if self._ip is not None:
+                return self._ip
+        self.refresh()
+        # Si no se pudieron leer las interfaces, como antes: '127.0.0.1' y nunca None
+        return self._ip or FALLBACK_IP
+
+    def addresses(self):
+        """Copia de las direcciones por interfaz"""
+        with self._lock:
+            return {interface: list(ips) for interface, ips in self._addresses.items()}
+
+    def refresh(self):
+        """
+        Releer las interfaces y avisar si algo cambió
+
+        Returns:
+            True si cambió la IP principal o las direcciones
+        """
+        try:
+            addresses = self.read_addresses()
+        except Exception as e:
+            logger.error(f'Error leyendo las interfaces de red: {e}')
+            return False
+        ip = self.pick_primary(addresses)
+
+        with self._lock:
+            previous_ip = self._ip
+            if previous_ip == ip and addresses == self._addresses:
+                return False
+            self._ip = ip
+            self._addresses = addresses
+        if previous_ip is None:
+            return False
+
+        self.changes += 1
+        logger.info(f'🌐 Direcciones de red cambiadas (IP principal: {previous_ip} -> {ip})')
+        if self.on_change:
+            try:
+                self.on_change({'ip': ip, 'previous_ip': previous_ip, 'addresses': addresses})
+            except Exception as e:
+                logger.error(f'Error notificando el cambio de IP: {e}')
+        return True
+
+    def start(self):
+        """Arrancar el hilo de seguimiento (idempotente)"""
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._loop, name='address-tracker', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        """Detener el seguimiento (el hilo sale en su siguiente despertar)"""
+        self._stop.set()
+
+    @staticmethod
+    def _open_netlink():
+        """Socket rtnetlink suscrito a cambios de enlaces, direcciones y rutas (solo Linux)"""
+        if not hasattr(socket, 'AF_NETLINK'):
+            return None
+        try:
+            sock = socket.socket(socket.AF_NETLINK, socket.SOCK_RAW, socket.NETLINK_ROUTE)
+            sock.bind((0, RTMGRP_LINK | RTMGRP_IPV4_IFADDR | RTMGRP_IPV6_IFADDR | RTMGRP_IPV4_ROUTE))
+            return sock
+        except OSError as e:
+            logger.info(f'Netlink no disponible ({e}), se comprobarán las direcciones periódicamente')
+            return None
+
+    @staticmethod
+    def _drain(sock, timeout):
+        """Consumir avisos hasta que pasen 'timeout' segundos sin ninguno"""
+        while select.select([sock], [], [], timeout)[0]:
+            # El contenido no importa: cualquier aviso provoca una relectura con psutil
+            sock.recv(65536)
+
+    def _loop(self):
+        self.refresh()
+        sock = self._open_netlink()
+        self.mode = 'netlink' if sock else 'poll'
+        try:
+            while not self._stop.is_set():
+                if sock is None:
+                    self._stop.wait(self.poll_interval)
+                else:
+                    try:
+                        ready, _, _ = select.select([sock], [], [], self.netlink_poll_interval)
+                        if ready:
+                            self._drain(sock, self.DEBOUNCE)
+                    except OSError as e:
+                        # Desbordamiento del buffer (ENOBUFS) u otro error: releer igualmente
+                        logger.debug(f'Aviso de netlink perdido: {e}')
+                if not self._stop.is_set():
+                    self.refresh()
+        finally:
+            if sock is not None:
+                sock.close()
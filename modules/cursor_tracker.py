@@ -0,0 +1,221 @@
+"""
+Módulo de seguimiento del cursor
+Posición y forma del puntero como canal ligero, separado del stream de píxeles
+"""
+import io
+import time
+import logging
+import hashlib
+import threading
+from collections import OrderedDict
+
+from .screen_stream import FramePacer
+
+logger = logging.getLogger(__name__)
+
+
+class CursorTracker:
+    """Lee posición y forma del cursor (XFixes en X11; solo posición con pyautogui)"""
+
+    # Formas distintas recordadas para responder a 'request_cursor_shape'
+    MAX_SHAPES = 64
+
+    def __init__(self):
+        self._display = None
+        self._root = None
+        self._get_cursor_image = None
+        self._pyautogui = None
+        self._last_serial = None
+        self._last_hash = None
+        self._shapes = OrderedDict()
+        self._shapes_lock = threading.Lock()
+
+    def open(self):
+        """
+        Abrir la conexión con el servidor gráfico
+
+        Returns:
+            True si se puede leer al menos la posición del cursor
+        """
+        try:
+            from Xlib import display as xdisplay
+
+            self._display = xdisplay.Display()
+            self._root = self._display.screen().root
+            if self._display.has_extension('XFIXES'):
+                self._display.xfixes_query_version()
+                getter = getattr(self._root, 'xfixes_get_cursor_image', None)
+                if getter is None:
+                    getter = lambda: self._display.xfixes_get_cursor_image(self._root)
+                self._get_cursor_image = getter
+            else:
+                logger.info('XFIXES no disponible: solo se enviará la posición del cursor')
+            return True
+        except Exception as e:
+            logger.info(f'Xlib no disponible para el cursor ({e}), usando pyautogui')
+            self._display = None
+
+        try:
+            import pyautogui
+            pyautogui.position()
+            self._pyautogui = pyautogui
+            return True
+        except Exception as e:
+            logger.warning(f'No se puede leer la posición del cursor: {e}')
+            return False
+
+    def close(self):
+        if self._display is not None:
+            try:
+                self._display.close()
+            except Exception:
+                pass
+        self._display = None
+        self._pyautogui = None
+
+    def position(self):
+        """Posición absoluta (x, y) del cursor en el escritorio"""
+        if self._display is not None:
+            pointer = self._root.query_pointer()
+            return pointer.root_x, pointer.root_y
+        x, y = self._pyautogui.position()
+        return int(x), int(y)
+
+    def shape_hash(self):
+        """
+        Hash de la forma actual del cursor (la imagen solo se procesa si cambió)
+
+        Returns:
+            Hash hex o None si el backend no da la forma
+        """
+        if self._get_cursor_image is None:
+            return None
+        reply = self._get_cursor_image()
+        if reply.cursor_serial == self._last_serial:
+            return self._last_hash
+        self._last_serial = reply.cursor_serial
+
+        import numpy as np
+
+        # ARGB premultiplicado en enteros de 32 bits -> bytes BGRA en little endian
+        pixels = np.asarray(reply.cursor_image, dtype='<u4').tobytes()
+        digest = hashlib.blake2b(pixels, digest_size=8)
+        digest.update(f'{reply.width}x{reply.height}+{reply.xhot}+{reply.yhot}'.encode())
+        shape_hash = digest.hexdigest()
+
+        with self._shapes_lock:
+            if shape_hash not in self._shapes:
+                self._shapes[shape_hash] = self._encode_shape(reply, pixels)
+                if len(self._shapes) > self.MAX_SHAPES:
+                    self._shapes.popitem(last=False)
+            else:
+                self._shapes.move_to_end(shape_hash)
+        self._last_hash = shape_hash
+        return shape_hash
+
+    @staticmethod
+    def _encode_shape(reply, pixels):
+        """PNG RGBA de la imagen del cursor con su punto activo"""
+        from PIL import Image
+
+        img = Image.frombuffer('RGBA', (reply.width, reply.height), pixels, 'raw', 'BGRa', 0, 1)
+        buffer = io.BytesIO()
+        img.save(buffer, format='PNG')
+        return {
+            'width': reply.width,
+            'height': reply.height,
+            'hot_x': reply.xhot,
+            'hot_y': reply.yhot,
+            'format': 'png',
+            'data': buffer.getvalue()
+        }
+
+    def get_shape(self, shape_hash):
+        """Forma cacheada por hash (None si ya no está)"""
+        with self._shapes_lock:
+            shape = self._shapes.get(shape_hash)
+            return dict(shape) if shape else None
+
+
+class CursorStream:
+    """Envía la posición del cursor a alta frecuencia y la forma solo cuando cambia"""
+
+    def __init__(self, emit, rate=30, shape_interval=0.1):
+        """
+        Inicializar canal del cursor
+
+        Args:
+            emit: Función emit(evento, payload)
+            rate: Lecturas de posición por segundo
+            shape_interval: Segundos entre comprobaciones de la forma
+        """
+        self.emit = emit
+        self.tracker = CursorTracker()
+        self.pacer = FramePacer(rate)
+        self.shape_interval = shape_interval
+        # Hashes cuya imagen ya tiene el servidor
+        self.sent_shapes = set()
+        self.updates_sent = 0
+        self.running = False
+        self._thread = None
+
+    @property
+    def rate(self):
+        return self.pacer.fps
+
+    @rate.setter
+    def rate(self, value):
+        self.pacer.fps = value
+
+    def start(self):
+        """Arrancar el hilo del cursor"""
+        if not self.tracker.open():
+            return False
+        self.running = True
+        self._thread = threading.Thread(target=self._loop, name='cursor-stream', daemon=True)
+        self._thread.start()
+        return True
+
+    def stop(self):
+        self.running = False
+
+    def send_shape(self, shape_hash):
+        """Enviar la imagen de una forma (la primera vez o si el servidor la pide)"""
+        shape = self.tracker.get_shape(shape_hash)
+        if shape is None:
+            return False
+        shape['hash'] = shape_hash
+        self.emit('cursor_shape', shape)
+        self.sent_shapes.add(shape_hash)
+        return True
+
+    def _loop(self):
+        last = None
+        shape_hash = None
+        shape_checked_at = 0.0
+        try:
+            while self.running:
+                self.pacer.wait(lambda: self.running)
+                if not self.running:
+                    break
+                try:
+                    x, y = self.tracker.position()
+                    now = time.monotonic()
+                    if now - shape_checked_at >= self.shape_interval:
+                        shape_checked_at = now
+                        shape_hash = self.tracker.shape_hash()
+                        if shape_hash and shape_hash not in self.sent_shapes:
+                            self.send_shape(shape_hash)
+                except Exception as e:
+                    logger.error(f'❌ Error leyendo el cursor: {e}')
+                    time.sleep(1)
+                    continue
+
+                # Solo se emite si algo cambió: el cursor quieto no cuesta nada
+                current = (x, y, shape_hash)
+                if current != last:
+                    last = current
+                    self.emit('cursor_update', {'x': x, 'y': y, 'shape': shape_hash, 'timestamp': time.time()})
+                    self.updates_sent += 1
+        finally:
+            self.tracker.close()
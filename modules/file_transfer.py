@@ -92,13 +92,14 @@ class FileTransfer:
                 'error': str(e)
             }
     
-    def read_file(self, filename, client_id=None):
+    def read_file(self, filename, client_id=None, encode=True):
         """
         Leer archivo para enviar
         
         Args:
             filename: Nombre del archivo
             client_id: ID del cliente (opcional, para archivos en carpeta de cliente)
+            encode: True para devolver base64, False para bytes crudos
             
         Returns:
             Dict con datos del archivo
@@ -121,7 +122,8 @@ class FileTransfer:
             with open(file_path, 'rb') as f:
                 file_data = f.read()
             
-            file_base64 = base64.b64encode(file_data).decode('utf-8')
+            if encode:
+                file_data = base64.b64encode(file_data).decode('utf-8')
             file_size = os.path.getsize(file_path)
             
             logger.info(f'Archivo leído: {filename} ({file_size} bytes)')
@@ -129,7 +131,7 @@ class FileTransfer:
             return {
                 'success': True,
                 'filename': filename,
-                'data': file_base64,
+                'data': file_data,
                 'size': file_size
             }
         
@@ -203,13 +205,14 @@ class FileTransfer:
             logger.error(f'Error eliminando archivo: {e}')
             return {'success': False, 'error': str(e)}
     
-    def split_file_chunks(self, file_data, chunk_size=64 * 1024):
+    def split_file_chunks(self, file_data, chunk_size=64 * 1024, binary=False):
         """
         Dividir archivo en chunks para transmisión
         
         Args:
             file_data: Datos del archivo en bytes
             chunk_size: Tamaño de cada chunk (default 64KB)
+            binary: True para chunks en bytes crudos (adjuntos binarios de socket.io)
             
         Returns:
             Lista de chunks
@@ -217,5 +220,8 @@ class FileTransfer:
         chunks = []
         for i in range(0, len(file_data), chunk_size):
             chunk = file_data[i:i + chunk_size]
-            chunks.append(base64.b64encode(chunk).decode('utf-8'))
+            if binary:
+                chunks.append(bytes(chunk))
+            else:
+                chunks.append(base64.b64encode(chunk).decode('utf-8'))
         return chunks
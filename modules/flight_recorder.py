@@ -0,0 +1,345 @@
+"""
+Módulo de grabación continua (flight recorder)
+Frames de baja frecuencia, solo cuando cambian, en un archivo circular de tamaño
+fijo mapeado en memoria con un índice compacto
+"""
+import os
+import re
+import mmap
+import time
+import struct
+import logging
+import threading
+from collections import deque, namedtuple
+from contextlib import contextmanager
+
+from .frame_encoders import FrameScaler, get_encoder
+from .screen_capture import as_image
+from .screen_stream import ScreenStreamPipeline, FrameChangeDetector
+
+logger = logging.getLogger(__name__)
+
+# Entrada del índice: dónde está cada frame dentro del anillo de datos
+RecordedFrame = namedtuple('RecordedFrame', 'timestamp slot offset length width height format')
+
+# Carpeta fija del agente: el servidor solo elige el nombre del archivo circular
+RECORDINGS_FOLDER = 'recordings'
+
+# Límites de lo que puede pedir el servidor: disco acotado y pocos FPS
+MIN_SIZE_MB = 1
+MAX_SIZE_MB = 1024
+MIN_FPS = 0.1
+MAX_FPS = 5.0
+_RING_NAME = re.compile(r'^[A-Za-z0-9_-][A-Za-z0-9_.-]{0,63}$')
+
+
+def validate_recording_settings(fps, size_mb):
+    """
+    Validar los parámetros de grabación pedidos por el servidor
+
+    Args:
+        fps: Frames por segundo (se ajusta a [MIN_FPS, MAX_FPS] como hace el pacer)
+        size_mb: Tamaño del archivo de datos en MB
+
+    Returns:
+        Tupla (fps, size_mb) utilizable
+
+    Raises:
+        ValueError: Si fps no es un número positivo o size_mb está fuera de rango
+    """
+    try:
+        fps = float(fps)
+        size_mb = float(size_mb)
+    except (TypeError, ValueError):
+        raise ValueError('fps y size_mb deben ser números')
+    if not fps > 0:
+        raise ValueError(f'fps debe ser mayor que 0 (recibido {fps})')
+    if not MIN_SIZE_MB <= size_mb <= MAX_SIZE_MB:
+        raise ValueError(f'size_mb debe estar entre {MIN_SIZE_MB} y {MAX_SIZE_MB} (recibido {size_mb})')
+    return min(MAX_FPS, max(MIN_FPS, fps)), size_mb
+
+
+def ring_path(name='flight_recorder'):
+    """
+    Ruta del archivo circular dentro de la carpeta de grabaciones
+
+    Args:
+        name: Nombre del archivo, sin carpetas (se añade '.ring' si falta)
+
+    Returns:
+        Ruta dentro de RECORDINGS_FOLDER
+
+    Raises:
+        ValueError: Si el nombre incluye carpetas o caracteres no permitidos
+    """
+    if not isinstance(name, str) or not _RING_NAME.match(name):
+        raise ValueError(f'Nombre de grabación no válido: {name!r}')
+    if not name.endswith('.ring'):
+        name += '.ring'
+    return os.path.join(RECORDINGS_FOLDER, name)
+
+
+class FrameRing:
+    """Archivo circular mapeado en memoria: cabecera + slots de índice + anillo de datos"""
+
+    MAGIC = b'FREC'
+    VERSION = 1
+    HEADER_SIZE = 64
+    # magic, versión, tamaño de datos, número de slots, siguiente offset, siguiente slot
+    HEADER = struct.Struct('<4sIQIQI')
+    # timestamp, offset, longitud, ancho, alto, formato (32 bytes por slot)
+    SLOT = struct.Struct('<dQIHHB7x')
+    FORMATS = ('jpeg', 'png', 'webp')
+
+    def __init__(self, path, data_size=64 * 1024 * 1024, index_slots=8192):
+        """
+        Abrir (o crear) el archivo circular
+
+        Args:
+            path: Ruta del archivo
+            data_size: Bytes reservados para frames (el disco usado no crece nunca)
+            index_slots: Frames máximos en el índice
+        """
+        self.path = path
+        self.data_size = data_size
+        self.index_slots = index_slots
+        self._data_start = self.HEADER_SIZE + index_slots * self.SLOT.size
+        self._lock = threading.Lock()
+        self._entries = deque()
+        self._write_offset = 0
+        self._next_slot = 0
+        self._readers = 0
+        self._close_pending = False
+        self.closed = False
+
+        folder = os.path.dirname(path)
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+        total_size = self._data_start + data_size
+        self._file = open(path, 'a+b')
+        self._file.seek(0, os.SEEK_END)
+        reuse = self._file.tell() == total_size
+        if not reuse:
+            self._file.truncate(total_size)
+        self._mm = mmap.mmap(self._file.fileno(), total_size)
+
+        if reuse and self._load():
+            logger.info(f'Grabación previa recuperada: {len(self._entries)} frames en {path}')
+        else:
+            self._reset()
+
+    def _load(self):
+        """Reconstruir el índice desde el archivo; False si no es compatible"""
+        magic, version, data_size, slots, write_offset, next_slot = self.HEADER.unpack_from(self._mm, 0)
+        if (magic, version, data_size, slots) != (self.MAGIC, self.VERSION, self.data_size, self.index_slots):
+            return False
+
+        entries = []
+        for slot in range(self.index_slots):
+            timestamp, offset, length, width, height, fmt = self.SLOT.unpack_from(self._mm, self._slot_position(slot))
+            if length and offset + length <= self.data_size and fmt < len(self.FORMATS):
+                entries.append(RecordedFrame(timestamp, slot, offset, length, width, height, self.FORMATS[fmt]))
+        entries.sort()
+        self._entries = deque(entries)
+        self._write_offset = write_offset
+        self._next_slot = next_slot
+        return True
+
+    def _reset(self):
+        self._mm[:self._data_start] = bytes(self._data_start)
+        self._entries.clear()
+        self._write_offset = 0
+        self._next_slot = 0
+        self._write_header()
+
+    def _write_header(self):
+        self.HEADER.pack_into(self._mm, 0, self.MAGIC, self.VERSION, self.data_size,
+                              self.index_slots, self._write_offset, self._next_slot)
+
+    def _slot_position(self, slot):
+        return self.HEADER_SIZE + slot * self.SLOT.size
+
+    def _evict_oldest(self):
+        entry = self._entries.popleft()
+        self.SLOT.pack_into(self._mm, self._slot_position(entry.slot), 0.0, 0, 0, 0, 0, 0)
+
+    def append(self, data, width, height, fmt='jpeg', timestamp=None):
+        """
+        Añadir un frame, descartando los más antiguos que ocupen su sitio
+
+        Args:
+            data: Bytes del frame codificado
+            width: Ancho del frame
+            height: Alto del frame
+            fmt: Formato ('jpeg', 'png', 'webp')
+            timestamp: Hora de captura (epoch); por defecto ahora
+
+        Returns:
+            True si se guardó
+        """
+        length = len(data)
+        if not length or length > self.data_size:
+            return False
+        timestamp = time.time() if timestamp is None else timestamp
+
+        with self._lock:
+            offset = self._write_offset
+            if offset + length > self.data_size:
+                # No cabe hasta el final: se vuelve al principio y se pierde la cola
+                while self._entries and self._entries[0].offset >= offset:
+                    self._evict_oldest()
+                offset = 0
+            while self._entries and self._entries[0].offset < offset + length and \
+                    self._entries[0].offset + self._entries[0].length > offset:
+                self._evict_oldest()
+            if len(self._entries) >= self.index_slots:
+                self._evict_oldest()
+
+            # Datos, luego el slot y por último la cabecera
+            start = self._data_start + offset
+            self._mm[start:start + length] = data
+            slot = self._next_slot
+            self.SLOT.pack_into(self._mm, self._slot_position(slot), timestamp, offset, length,
+                                width, height, self.FORMATS.index(fmt) if fmt in self.FORMATS else 0)
+            self._entries.append(RecordedFrame(timestamp, slot, offset, length, width, height, fmt))
+            self._write_offset = offset + length
+            self._next_slot = (slot + 1) % self.index_slots
+            self._write_header()
+        return True
+
+    def index(self, start=None, end=None):
+        """
+        Entradas del índice en un rango de tiempo
+
+        Args:
+            start: Desde (epoch, incluido); None = desde el principio
+            end: Hasta (epoch, incluido); None = hasta ahora
+
+        Returns:
+            Lista de RecordedFrame en orden cronológico
+        """
+        with self._lock:
+            return [entry for entry in self._entries
+                    if (start is None or entry.timestamp >= start) and (end is None or entry.timestamp <= end)]
+
+    @contextmanager
+    def reading(self):
+        """
+        Mantener el archivo abierto mientras se leen frames: un close() durante la
+        lectura se aplaza hasta que termine el último lector
+
+        Raises:
+            ValueError: Si el archivo ya está cerrado
+        """
+        with self._lock:
+            if self.closed or self._close_pending:
+                raise ValueError('El archivo de grabación está cerrado')
+            self._readers += 1
+        try:
+            yield self
+        finally:
+            with self._lock:
+                self._readers -= 1
+                if self._close_pending and not self._readers:
+                    self._close()
+
+    def read(self, entry):
+        """
+        Bytes de un frame del índice
+
+        Returns:
+            Bytes o None si ya fue sobrescrito (o el archivo está cerrado)
+        """
+        with self._lock:
+            if self.closed or not self._entries or entry.timestamp < self._entries[0].timestamp:
+                return None
+            start = self._data_start + entry.offset
+            return bytes(self._mm[start:start + entry.length])
+
+    def summary(self):
+        """Rango de tiempo, frames y bytes ocupados"""
+        with self._lock:
+            if not self._entries:
+                return {'frames': 0, 'bytes': 0, 'capacity': self.data_size}
+            return {
+                'frames': len(self._entries),
+                'start': self._entries[0].timestamp,
+                'end': self._entries[-1].timestamp,
+                'bytes': sum(entry.length for entry in self._entries),
+                'capacity': self.data_size
+            }
+
+    def close(self):
+        """Cerrar el archivo (cuando termine el último lector si hay alguno)"""
+        with self._lock:
+            if self._readers:
+                self._close_pending = True
+            elif not self.closed:
+                self._close()
+
+    def _close(self):
+        self._mm.flush()
+        self._mm.close()
+        self._file.close()
+        self.closed = True
+
+
+class FlightRecorder:
+    """Grabación en segundo plano: pocos FPS, solo frames que cambian, JPEG pequeño"""
+
+    def __init__(self, capture, name='flight_recorder', size_mb=64,
+                 fps=0.5, scale=0.5, quality=40, ring=None):
+        """
+        Inicializar grabador
+
+        Args:
+            capture: Función sin argumentos que devuelve un frame (o None)
+            name: Nombre del archivo circular dentro de RECORDINGS_FOLDER
+            size_mb: Tamaño fijo del archivo de datos en MB
+            fps: Frames por segundo como máximo
+            scale: Escala de los frames grabados
+            quality: Calidad JPEG
+            ring: FrameRing ya abierto con la misma ruta y tamaño (se reutiliza)
+        """
+        fps, size_mb = validate_recording_settings(fps, size_mb)
+        path = ring_path(name)
+        data_size = int(size_mb * 1024 * 1024)
+        if ring is None or ring.closed or ring.path != path or ring.data_size != data_size:
+            ring = FrameRing(path, data_size=data_size)
+        self.ring = ring
+        self.scaler = FrameScaler(scale, 'fast')
+        self.encoder = get_encoder('jpeg')
+        self.quality = quality
+        self.pipeline = ScreenStreamPipeline(
+            capture, self._encode, self._store, fps,
+            change_detector=FrameChangeDetector()
+        )
+
+    @property
+    def running(self):
+        return self.pipeline.running
+
+    def _encode(self, frame):
+        img = self.scaler(as_image(frame))
+        encoded = self.encoder.encode(img, self.quality)
+        return {'data': encoded['data'], 'width': img.width, 'height': img.height,
+                'format': encoded['format'], 'timestamp': time.time()}
+
+    def _store(self, packet):
+        self.ring.append(packet['data'], packet['width'], packet['height'], packet['format'], packet['timestamp'])
+
+    def start(self):
+        self.pipeline.start()
+
+    def stop(self):
+        """Detener la grabación (el archivo se conserva para consultas posteriores)"""
+        self.pipeline.stop()
+
+    def status(self):
+        status = self.ring.summary()
+        status.update({
+            'recording': self.running,
+            'fps': self.pipeline.fps,
+            'frames_unchanged': self.pipeline.frames_unchanged
+        })
+        return status
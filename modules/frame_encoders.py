@@ -0,0 +1,529 @@
+"""
+Módulo de codificación de frames
+Registro de codificadores (JPEG, libjpeg-turbo, WebP, PNG con paleta), codificación
+por franjas en paralelo y escalado de frames
+"""
+import io
+import os
+import time
+import logging
+import threading
+
+from .screen_capture import RawFrame, as_image
+
+logger = logging.getLogger(__name__)
+
+
+def encode_jpeg(img, quality=80, optimize=True):
+    """
+    Codificar una imagen PIL como JPEG
+    
+    Args:
+        img: Imagen PIL
+        quality: Calidad JPEG (1-95)
+        optimize: Pasada extra de Huffman (más pequeño, más lento)
+        
+    Returns:
+        Bytes del JPEG
+    """
+    if img.mode not in ('RGB', 'L'):
+        img = img.convert('RGB')
+    buffer = io.BytesIO()
+    img.save(buffer, format='JPEG', quality=quality, optimize=optimize)
+    return buffer.getvalue()
+
+
+class FrameEncoder:
+    """Codificador base: subclases implementan _encode(img, quality)"""
+
+    name = None
+    format = None
+    # True si acepta RawFrame BGRA directamente (sin pasar por PIL)
+    accepts_raw = False
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.frames = 0
+        self.total_bytes = 0
+        self.total_ms = 0.0
+
+    def _encode(self, img, quality):
+        raise NotImplementedError
+
+    def encode(self, img, quality=60):
+        """
+        Codificar un frame midiendo tiempo y tamaño
+        
+        Args:
+            img: Imagen PIL
+            quality: Calidad (1-95; ignorada por los formatos sin pérdida)
+            
+        Returns:
+            Dict con 'data', 'format', 'encoder', 'size' y 'encode_ms'
+        """
+        if not self.accepts_raw:
+            img = as_image(img)
+
+        start = time.perf_counter()
+        data = self._encode(img, quality)
+        encode_ms = (time.perf_counter() - start) * 1000
+
+        with self._lock:
+            self.frames += 1
+            self.total_bytes += len(data)
+            self.total_ms += encode_ms
+
+        return {
+            'data': data,
+            'format': self.format,
+            'encoder': self.name,
+            'size': len(data),
+            'encode_ms': encode_ms
+        }
+
+    def stats(self):
+        """Tamaño y coste medios: permite comparar bytes por ms de CPU"""
+        with self._lock:
+            if not self.frames:
+                return {'frames': 0}
+            return {
+                'frames': self.frames,
+                'avg_bytes': int(self.total_bytes / self.frames),
+                'avg_encode_ms': round(self.total_ms / self.frames, 2),
+                'bytes_per_ms': round(self.total_bytes / self.total_ms, 1) if self.total_ms else None
+            }
+
+
+class JpegEncoder(FrameEncoder):
+    """JPEG con o sin la pasada extra de optimización Huffman"""
+
+    format = 'jpeg'
+
+    def __init__(self, optimize=False):
+        super().__init__()
+        self.optimize = optimize
+        self.name = 'jpeg-optimized' if optimize else 'jpeg'
+
+    def _encode(self, img, quality):
+        return encode_jpeg(img, quality, self.optimize)
+
+
+class TurboJpegEncoder(FrameEncoder):
+    """JPEG con libjpeg-turbo (PyTurboJPEG): codifica el buffer BGRA de mss sin copias"""
+
+    format = 'jpeg'
+    accepts_raw = True
+
+    def __init__(self, turbo, subsampling='420', fast_dct=True):
+        """
+        Args:
+            turbo: Instancia de turbojpeg.TurboJPEG
+            subsampling: Submuestreo de croma ('444', '422', '420', 'gray')
+            fast_dct: Usar la DCT rápida (algo menos precisa)
+        """
+        import turbojpeg
+
+        super().__init__()
+        self._turbo = turbo
+        self._tj = turbojpeg
+        samplings = {
+            '444': turbojpeg.TJSAMP_444,
+            '422': turbojpeg.TJSAMP_422,
+            '420': turbojpeg.TJSAMP_420,
+            'gray': turbojpeg.TJSAMP_GRAY
+        }
+        if subsampling not in samplings:
+            subsampling = '420'
+        self.subsampling = subsampling
+        self.fast_dct = fast_dct
+        self._jpeg_subsample = samplings[subsampling]
+        self._flags = turbojpeg.TJFLAG_FASTDCT if fast_dct else 0
+        self.name = turbo_encoder_name(subsampling, fast_dct)
+
+    def _encode(self, img, quality):
+        import numpy as np
+
+        if hasattr(img, 'array'):
+            # RawFrame: vista BGRA directa del buffer de captura
+            array = img.array
+            pixel_format = self._tj.TJPF_BGRA
+        else:
+            if img.mode != 'RGB':
+                img = img.convert('RGB')
+            array = np.asarray(img)
+            pixel_format = self._tj.TJPF_RGB
+        return self._turbo.encode(array, quality=quality, pixel_format=pixel_format,
+                                  jpeg_subsample=self._jpeg_subsample, flags=self._flags)
+
+
+def turbo_encoder_name(subsampling='420', fast_dct=True):
+    """Nombre de registro de una variante de TurboJpegEncoder"""
+    if subsampling == '420' and fast_dct:
+        return 'turbojpeg'
+    return f'turbojpeg-{subsampling}' + ('-fastdct' if fast_dct else '')
+
+
+class WebpEncoder(FrameEncoder):
+    """WebP con pérdida o sin pérdida (method bajo: prioriza velocidad)"""
+
+    format = 'webp'
+
+    def __init__(self, lossless=False, method=2):
+        super().__init__()
+        self.lossless = lossless
+        self.method = method
+        self.name = 'webp-lossless' if lossless else 'webp'
+
+    def _encode(self, img, quality):
+        if img.mode not in ('RGB', 'L'):
+            img = img.convert('RGB')
+        buffer = io.BytesIO()
+        img.save(buffer, format='WEBP', quality=quality, lossless=self.lossless, method=self.method)
+        return buffer.getvalue()
+
+
+class PngPaletteEncoder(FrameEncoder):
+    """PNG con paleta: ideal para interfaces con pocos colores y texto nítido"""
+
+    name = 'png-palette'
+    format = 'png'
+
+    def __init__(self, colors=256, compress_level=1):
+        super().__init__()
+        self.colors = colors
+        self.compress_level = compress_level
+
+    def _encode(self, img, quality):
+        from PIL import Image
+
+        if img.mode != 'RGB':
+            img = img.convert('RGB')
+        paletted = img.quantize(colors=self.colors, method=Image.Quantize.FASTOCTREE)
+        buffer = io.BytesIO()
+        paletted.save(buffer, format='PNG', compress_level=self.compress_level)
+        return buffer.getvalue()
+
+
+class AutoEncoder(FrameEncoder):
+    """Elige por frame: PNG con paleta si hay pocos colores, si no JPEG"""
+
+    name = 'auto'
+
+    def __init__(self, max_colors=256, sample_factor=8):
+        super().__init__()
+        self.max_colors = max_colors
+        self.sample_factor = sample_factor
+
+    def choose(self, img):
+        """Heurística barata: contar colores en una muestra (sin promediar, conserva la paleta)"""
+        from PIL import Image
+
+        sample = img
+        if min(img.size) >= self.sample_factor * 8:
+            size = (img.width // self.sample_factor, img.height // self.sample_factor)
+            sample = img.resize(size, Image.Resampling.NEAREST)
+        colors = sample.getcolors(maxcolors=self.max_colors)
+        return get_encoder('png-palette' if colors is not None else 'jpeg')
+
+    def encode(self, img, quality=60):
+        # Se delega: las estadísticas quedan en el codificador elegido
+        return self.choose(img).encode(img, quality)
+
+    def stats(self):
+        return {'delegates': True}
+
+
+# Registro de codificadores disponibles por nombre
+ENCODERS = {}
+
+
+def register_encoder(encoder):
+    """Registrar un codificador bajo su nombre"""
+    ENCODERS[encoder.name] = encoder
+    return encoder
+
+
+_turbo = None
+
+
+def _load_turbojpeg():
+    """Cargar libjpeg-turbo si PyTurboJPEG y la librería nativa están instalados"""
+    global _turbo
+    if _turbo is None:
+        try:
+            from turbojpeg import TurboJPEG
+            _turbo = TurboJPEG()
+        except Exception as e:
+            logger.info(f'libjpeg-turbo no disponible, se usará PIL para JPEG: {e}')
+            _turbo = False
+    return _turbo or None
+
+
+def _webp_available():
+    try:
+        from PIL import features
+        return features.check('webp')
+    except Exception:
+        return False
+
+
+register_encoder(JpegEncoder(optimize=False))
+register_encoder(JpegEncoder(optimize=True))
+register_encoder(PngPaletteEncoder())
+register_encoder(AutoEncoder())
+if _load_turbojpeg():
+    register_encoder(TurboJpegEncoder(_turbo))
+if _webp_available():
+    register_encoder(WebpEncoder(lossless=False))
+    register_encoder(WebpEncoder(lossless=True))
+
+
+def get_encoder(name='jpeg', subsampling='420', fast_dct=True):
+    """
+    Obtener un codificador del registro
+    
+    Args:
+        name: 'jpeg', 'jpeg-optimized', 'turbojpeg', 'webp', 'webp-lossless',
+              'png-palette' o 'auto'
+        subsampling: Submuestreo de croma para 'turbojpeg' ('444', '422', '420', 'gray')
+        fast_dct: DCT rápida para 'turbojpeg'
+        
+    Returns:
+        FrameEncoder (JPEG de PIL si el nombre no existe o no está disponible)
+    """
+    if name == 'turbojpeg':
+        variant = turbo_encoder_name(subsampling, fast_dct)
+        if variant not in ENCODERS and _load_turbojpeg():
+            register_encoder(TurboJpegEncoder(_turbo, subsampling, fast_dct))
+        name = variant
+
+    encoder = ENCODERS.get(name)
+    if encoder is None:
+        logger.warning(f'Codificador {name} no disponible, usando jpeg')
+        encoder = ENCODERS['jpeg']
+    return encoder
+
+
+def encoder_stats():
+    """Estadísticas de tamaño/tiempo de cada codificador usado"""
+    stats = {name: encoder.stats() for name, encoder in ENCODERS.items()}
+    return {name: values for name, values in stats.items() if values.get('frames')}
+
+
+_stripe_pool = None
+_stripe_pool_lock = threading.Lock()
+
+
+def _get_stripe_pool():
+    """Pool de hilos compartido por todos los streams (PIL y libjpeg-turbo liberan el GIL al codificar)"""
+    global _stripe_pool
+    with _stripe_pool_lock:
+        if _stripe_pool is None:
+            from concurrent.futures import ThreadPoolExecutor
+            _stripe_pool = ThreadPoolExecutor(max_workers=min(os.cpu_count() or 1, 8),
+                                              thread_name_prefix='stripe-encoder')
+        return _stripe_pool
+
+
+def split_stripes(height, count, align=16):
+    """
+    Dividir una altura en franjas horizontales
+
+    Args:
+        height: Alto del frame
+        count: Número de franjas deseado
+        align: Alineación en píxeles (múltiplo del MCU JPEG para no crear bordes)
+
+    Returns:
+        Lista de tuplas (y, alto)
+    """
+    stripe_height = -(-height // count)
+    stripe_height = max(align, -(-stripe_height // align) * align)
+    return [(y, min(stripe_height, height - y)) for y in range(0, height, stripe_height)]
+
+
+class StripeEncoder:
+    """Codifica frames grandes (4K, ultrawide) en franjas independientes en paralelo"""
+
+    # Píxeles a partir de los cuales el modo 'auto' divide el frame (~1440p)
+    AUTO_MIN_PIXELS = 2560 * 1440
+    ALIGN = 16
+
+    def __init__(self, encoder, stripes='auto'):
+        """
+        Inicializar codificador por franjas
+
+        Args:
+            encoder: FrameEncoder usado para cada franja
+            stripes: Número de franjas o 'auto' (una por núcleo en frames grandes)
+        """
+        self.encoder = encoder
+        self.stripes = stripes
+
+    def stripe_count(self, size):
+        """Número de franjas para un frame de este tamaño (1 = codificar entero)"""
+        if self.stripes == 'auto':
+            if size[0] * size[1] < self.AUTO_MIN_PIXELS:
+                return 1
+            count = min(os.cpu_count() or 1, 8)
+        else:
+            count = int(self.stripes)
+        return max(1, min(count, size[1] // self.ALIGN))
+
+    def _crop(self, img, y, height):
+        if hasattr(img, 'bgra'):
+            # RawFrame: las filas son contiguas, la franja es una vista sin copia
+            row = img.width * 4
+            view = memoryview(img.bgra)[y * row:(y + height) * row]
+            return RawFrame(view, (img.width, height))
+        return img.crop((0, y, img.width, y + height))
+
+    def encode(self, img, quality=60):
+        """
+        Codificar un frame en franjas
+
+        Args:
+            img: Imagen PIL o RawFrame (si el codificador acepta BGRA)
+            quality: Calidad (1-95)
+
+        Returns:
+            Dict con 'stripes' (lista de {'y', 'height', 'format', 'data'}), 'format',
+            'encoder', 'size' y 'encode_ms'
+        """
+        if not self.encoder.accepts_raw:
+            img = as_image(img)
+
+        start = time.perf_counter()
+        bounds = split_stripes(img.height, self.stripe_count(img.size), self.ALIGN)
+        futures = [
+            _get_stripe_pool().submit(self.encoder.encode, self._crop(img, y, height), quality)
+            for y, height in bounds
+        ]
+        stripes = []
+        for (y, height), future in zip(bounds, futures):
+            encoded = future.result()
+            # Con 'auto' cada franja puede salir en un formato distinto
+            stripes.append({'y': y, 'height': height, 'format': encoded['format'], 'data': encoded['data']})
+        return {
+            'stripes': stripes,
+            'format': self.encoder.format or 'mixed',
+            'encoder': self.encoder.name,
+            'size': sum(len(stripe['data']) for stripe in stripes),
+            'encode_ms': (time.perf_counter() - start) * 1000
+        }
+
+
+# Niveles de remuestreo: (filtro PIL, reducing_gap, usar reduce() en escalas 1/2^n)
+RESAMPLE_TIERS = {
+    'fast': ('BOX', None, True),
+    'balanced': ('BILINEAR', 2.0, True),
+    'sharp': ('LANCZOS', 3.0, False)
+}
+
+
+def _power_of_two_factor(scale):
+    """Factor entero de reducción si la escala es exactamente 1/2^n, si no None"""
+    if scale <= 0 or scale >= 1:
+        return None
+    factor = round(1 / scale)
+    if abs(1 / factor - scale) < 1e-6 and factor & (factor - 1) == 0:
+        return factor
+    return None
+
+
+class FrameScaler:
+    """Escalado de frames con geometría cacheada por stream"""
+
+    def __init__(self, scale=1.0, resample='balanced'):
+        """
+        Inicializar escalador
+        
+        Args:
+            scale: Factor de escala
+            resample: Nivel de calidad ('fast', 'balanced', 'sharp')
+        """
+        if resample not in RESAMPLE_TIERS:
+            resample = 'balanced'
+        self.scale = scale
+        self.resample = resample
+        self._geometry = {}
+
+    def geometry(self, size):
+        """
+        Calcular (y cachear) el plan de escalado para un tamaño de origen
+        
+        Returns:
+            Tupla (tamaño destino, factor de reduce() o None, filtro, reducing_gap)
+        """
+        key = (size, self.scale, self.resample)
+        plan = self._geometry.get(key)
+        if plan is None:
+            from PIL import Image
+            
+            filter_name, reducing_gap, use_reduce = RESAMPLE_TIERS[self.resample]
+            target = (max(1, int(size[0] * self.scale)), max(1, int(size[1] * self.scale)))
+            factor = _power_of_two_factor(self.scale) if use_reduce else None
+            plan = (target, factor, getattr(Image.Resampling, filter_name), reducing_gap)
+            self._geometry[key] = plan
+        return plan
+
+    def __call__(self, img, scale=None):
+        """
+        Escalar una imagen PIL
+        
+        Args:
+            img: Imagen PIL
+            scale: Nueva escala opcional (p. ej. del controlador adaptativo)
+        """
+        if scale is not None:
+            self.scale = scale
+        if self.scale == 1.0:
+            return img
+        
+        target, factor, resample, reducing_gap = self.geometry(img.size)
+        if factor is not None:
+            img = img.reduce(factor)
+            if img.size == target:
+                return img
+        return img.resize(target, resample, reducing_gap=reducing_gap)
+
+
+def scale_image(img, scale=1.0, resample='sharp'):
+    """
+    Redimensionar una imagen PIL por un factor de escala
+    
+    Args:
+        img: Imagen PIL
+        scale: Factor de escala (1.0 = sin cambios)
+        resample: Nivel de calidad ('fast', 'balanced', 'sharp')
+        
+    Returns:
+        Imagen PIL redimensionada
+    """
+    return FrameScaler(scale, resample)(img)
+
+
+def make_thumbnail(img, width=240):
+    """
+    Miniatura barata para el muro de equipos
+
+    Reducción entera por bloques (reduce) hasta cerca del ancho pedido y un
+    único BILINEAR sobre la imagen ya pequeña.
+
+    Args:
+        img: Imagen PIL
+        width: Ancho de la miniatura en píxeles (se conserva la proporción)
+
+    Returns:
+        Imagen PIL de la miniatura
+    """
+    from PIL import Image
+
+    width = max(16, min(int(width), img.width))
+    height = max(1, round(img.height * width / img.width))
+    factor = img.width // width
+    if factor >= 2:
+        img = img.reduce(factor)
+    if img.size != (width, height):
+        img = img.resize((width, height), Image.Resampling.BILINEAR)
+    return img
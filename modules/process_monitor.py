@@ -0,0 +1,225 @@
+"""
+Módulo de monitoreo de procesos
+Top-N de procesos por CPU, memoria o E/S con handles de psutil reutilizados entre ticks
+"""
+import time
+import logging
+import threading
+
+import psutil
+
+logger = logging.getLogger(__name__)
+
+
+class ProcessSampler:
+    """Muestreo incremental de procesos: solo se abren handles para los PIDs nuevos"""
+
+    SORT_KEYS = {
+        'cpu': 'cpu_percent',
+        'memory': 'memory_rss',
+        'io': 'io_bytes_per_s'
+    }
+
+    def __init__(self, interval=2.0, idle_timeout=60.0):
+        """
+        Inicializar muestreo
+
+        Args:
+            interval: Segundos entre ticks
+            idle_timeout: Segundos sin consultas tras los que se detiene el hilo
+        """
+        self.interval = interval
+        self.idle_timeout = idle_timeout
+        self._lock = threading.Lock()
+        self._procs = {}
+        self._stats = {}
+        self._io_previous = {}
+        self._thread = None
+        self._last_request = 0.0
+        self._first_tick = threading.Event()
+        self._wake = threading.Event()
+        # La E/S cuesta una lectura más por proceso: solo se mide si alguien la pide,
+        # y los bytes/s existen a partir de la segunda lectura seguida
+        self._io_wanted_until = 0.0
+        self._io_ticks = 0
+        self._io_ready = threading.Event()
+        self.last_tick = None
+        self.tick_ms = None
+        self.ticks = 0
+
+    def _track(self, pid):
+        """Abrir el handle de un PID nuevo y guardar sus datos fijos"""
+        proc = psutil.Process(pid)
+        with proc.oneshot():
+            info = {
+                'pid': pid,
+                'name': proc.name(),
+                'username': None,
+                'create_time': proc.create_time()
+            }
+            try:
+                info['username'] = proc.username()
+            except (psutil.AccessDenied, KeyError):
+                pass
+            # Primera llamada: fija la referencia, el valor útil llega en el siguiente tick
+            proc.cpu_percent(interval=None)
+        self._procs[pid] = proc
+        self._stats[pid] = info
+
+    def tick(self):
+        """Un muestreo: diff de PIDs y lectura de los procesos conocidos"""
+        start = time.perf_counter()
+        now = time.monotonic()
+        measure_io = now < self._io_wanted_until
+
+        pids = set(psutil.pids())
+        known = set(self._procs)
+        for pid in known - pids:
+            self._forget(pid)
+        for pid in pids - known:
+            try:
+                self._track(pid)
+            except (psutil.NoSuchProcess, psutil.AccessDenied, psutil.ZombieProcess):
+                continue
+
+        total_memory = psutil.virtual_memory().total
+        for pid, proc in list(self._procs.items()):
+            try:
+                # PID + hora de creación identifican al proceso: si el PID se reutilizó
+                # entre dos ticks, el handle (nombre, usuario, contadores) es de otro
+                if not proc.is_running():
+                    self._forget(pid)
+                    if pid in pids:
+                        self._track(pid)
+                    continue
+            except (psutil.NoSuchProcess, psutil.AccessDenied, psutil.ZombieProcess):
+                self._forget(pid)
+                continue
+            stats = self._stats[pid]
+            try:
+                with proc.oneshot():
+                    stats['cpu_percent'] = proc.cpu_percent(interval=None)
+                    stats['memory_rss'] = proc.memory_info().rss
+                    if measure_io:
+                        self._sample_io(pid, proc, stats, now)
+            except (psutil.NoSuchProcess, psutil.ZombieProcess):
+                self._forget(pid)
+            except psutil.AccessDenied:
+                continue
+            else:
+                stats['memory_percent'] = round(stats['memory_rss'] * 100 / total_memory, 2)
+
+        if measure_io:
+            self._io_ticks += 1
+            if self._io_ticks >= 2:
+                self._io_ready.set()
+        elif self._io_ticks:
+            self._io_ticks = 0
+            self._io_ready.clear()
+            self._io_previous.clear()
+            for stats in self._stats.values():
+                stats.pop('io_bytes_per_s', None)
+
+        with self._lock:
+            self.last_tick = now
+            self.tick_ms = round((time.perf_counter() - start) * 1000, 2)
+            self.ticks += 1
+
+    def _sample_io(self, pid, proc, stats, now):
+        """Bytes/s de lectura+escritura desde el tick anterior"""
+        try:
+            counters = proc.io_counters()
+        except (psutil.AccessDenied, AttributeError):
+            return
+        total = counters.read_bytes + counters.write_bytes
+        previous = self._io_previous.get(pid)
+        if previous is not None and now > previous[0]:
+            stats['io_bytes_per_s'] = int((total - previous[1]) / (now - previous[0]))
+        self._io_previous[pid] = (now, total)
+
+    def _forget(self, pid):
+        self._procs.pop(pid, None)
+        self._stats.pop(pid, None)
+        self._io_previous.pop(pid, None)
+
+    def _loop(self):
+        # El CPU% necesita dos lecturas: un tick de referencia corto al arrancar
+        warmup = True
+        while True:
+            with self._lock:
+                if time.monotonic() - self._last_request >= self.idle_timeout:
+                    self._thread = None
+                    self._procs.clear()
+                    self._stats.clear()
+                    self._io_previous.clear()
+                    self._first_tick.clear()
+                    self._io_ticks = 0
+                    self._io_ready.clear()
+                    logger.info('Muestreo de procesos detenido por inactividad')
+                    return
+            try:
+                self.tick()
+            except Exception as e:
+                logger.error(f'Error muestreando procesos: {e}')
+            if warmup:
+                warmup = False
+                self._sleep(min(self.interval, 1.0))
+                continue
+            self._first_tick.set()
+            # Tras la primera lectura de E/S, la segunda (la que da bytes/s) se adelanta
+            self._sleep(min(self.interval, 1.0) if self._io_ticks == 1 else self.interval)
+
+    def _sleep(self, seconds):
+        """Esperar al siguiente tick (top() puede adelantarlo)"""
+        self._wake.wait(seconds)
+        self._wake.clear()
+
+    def _ensure_running(self):
+        with self._lock:
+            self._last_request = time.monotonic()
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._loop, name='process-sampler', daemon=True)
+                self._thread.start()
+
+    def top(self, n=10, sort_by='cpu'):
+        """
+        Procesos que más consumen
+
+        Args:
+            n: Número de procesos
+            sort_by: 'cpu', 'memory' o 'io'
+
+        Returns:
+            Dict con 'processes', 'sort_by', 'total_processes', 'tick_ms' y 'sample_age'
+        """
+        if sort_by not in self.SORT_KEYS:
+            sort_by = 'cpu'
+        if sort_by == 'io':
+            self._io_wanted_until = time.monotonic() + self.idle_timeout
+            if not self._io_ready.is_set():
+                # Empezar a medir E/S ya, sin esperar al siguiente tick
+                self._wake.set()
+
+        # Solo la primera consulta espera (≈1 s) a tener dos lecturas de CPU (o de E/S)
+        self._ensure_running()
+        self._first_tick.wait(timeout=5.0)
+        if sort_by == 'io':
+            self._io_ready.wait(timeout=5.0)
+
+        key = self.SORT_KEYS[sort_by]
+        processes = [dict(stats) for stats in list(self._stats.values()) if key in stats]
+        processes.sort(key=lambda stats: stats[key], reverse=True)
+        for stats in processes:
+            stats.pop('create_time', None)
+            stats['memory_rss_mb'] = round(stats.pop('memory_rss', 0) / (1024 ** 2), 1)
+
+        with self._lock:
+            sample_age = round(time.monotonic() - self.last_tick, 3) if self.last_tick else None
+            return {
+                'processes': processes[:n],
+                'sort_by': sort_by,
+                'total_processes': len(self._stats),
+                'cpu_count': psutil.cpu_count(),
+                'tick_ms': self.tick_ms,
+                'sample_age': sample_age
+            }
@@ -13,6 +13,10 @@ import glob
 import signal
 import threading
 
+from .screen_capture import CaptureBackend, as_image
+from .frame_encoders import get_encoder, scale_image
+from .stream_metrics import StageMetrics
+
 logger = logging.getLogger(__name__)
 
 class RemoteControl:
@@ -28,6 +32,9 @@ class RemoteControl:
         # Variables para Wayland
         self.wayland_session = self._detect_wayland()
         
+        # Backend de captura persistente (se sondea en el primer frame)
+        self.capture_backend = CaptureBackend(self.wayland_session)
+        
         logger.info(f'RemoteControl inicializado para {self.system}')
         if self.wayland_session:
             logger.warning('Detectado entorno Wayland - usando métodos AGRESIVOS')
@@ -453,110 +460,116 @@ done
         except Exception as e:
             return {'success': False, 'error': str(e)}
 
-    def capture_screenshot(self, quality=80, scale=1.0):
-        """Capturar screenshot de la pantalla de manera robusta"""
-        import io
-        import base64
-        from PIL import Image, ImageDraw, ImageFont
-        import tempfile
-        
-        img = None
-        method_used = None
+    def get_monitors(self, refresh=False, probe=True):
+        """
+        Enumerar la geometría de los monitores (índice 0 = todos)
         
+        Args:
+            refresh: Volver a consultar en lugar de usar la caché
+            probe: Sondear el backend de captura si aún no se eligió (False = solo
+                   leer la geometría, sin capturar; p. ej. para el inventario)
+        """
         try:
-            # Método 1: Intentar grim primero si es Wayland (herramienta nativa más confiable)
-            if self.wayland_session and img is None:
-                try:
-                    with tempfile.NamedTemporaryFile(suffix='.png', delete=False) as tmp:
-                        tmp_name = tmp.name
-                    
-                    result = subprocess.run(['grim', tmp_name], 
-                                          check=True, 
-                                          timeout=2, 
-                                          stdout=subprocess.DEVNULL, 
-                                          stderr=subprocess.DEVNULL)
-                    
-                    if os.path.exists(tmp_name) and os.path.getsize(tmp_name) > 0:
-                        img = Image.open(tmp_name)
-                        img.load()
-                        method_used = 'grim'
-                    try:
-                        os.unlink(tmp_name)
-                    except:
-                        pass
-                except FileNotFoundError:
-                    # grim no está instalado
-                    pass
-                except Exception:
-                    pass
+            if not probe:
+                return {'success': True, 'monitors': self.capture_backend.peek_monitors()}
+            return {'success': True, 'monitors': self.capture_backend.list_monitors(refresh)}
+        except Exception as e:
+            logger.error(f'Error enumerando monitores: {e}')
+            return {'success': False, 'error': str(e)}
 
-            # Método 2: PyAutoGUI (bastante compatible con X11 via XWayland)
-            if img is None:
-                try:
-                    import pyautogui
-                    # Configurar DISPLAY si no existe
-                    env_backup = os.environ.get('DISPLAY')
-                    if 'DISPLAY' not in os.environ:
-                        os.environ['DISPLAY'] = ':0'
-                    
-                    img = pyautogui.screenshot()
-                    method_used = 'pyautogui'
-                    
-                    # Restaurar DISPLAY
-                    if env_backup is None and 'DISPLAY' in os.environ:
-                        del os.environ['DISPLAY']
-                except Exception as e:
-                    logger.warning(f'Fallo PyAutoGUI: {e}')
-            
-            # Método 3: MSS (rápido pero puede fallar en Wayland)
-            if img is None:
-                try:
-                    import mss
-                    with mss.mss() as sct:
-                        monitor = sct.monitors[1] if len(sct.monitors) > 1 else sct.monitors[0]
-                        screenshot = sct.grab(monitor)
-                        img = Image.frombytes('RGB', screenshot.size, screenshot.rgb)
-                        method_used = 'mss'
-                except Exception as e:
-                    logger.warning(f'Fallo MSS: {e}')
+    def capture_frame(self, monitor=None, region=None):
+        """
+        Capturar la pantalla sin escalar ni convertir
+        
+        Args:
+            monitor: Índice de monitor, 'all' o None (área por defecto)
+            region: Rectángulo a capturar (relativo al monitor si se indica uno, salvo
+                    que lleve 'absolute', como la geometría de una ventana)
+            
+        Returns:
+            RawFrame BGRA si el backend lo permite (mss), si no imagen PIL
+            (imagen de error informativa si la captura falla)
+        """
+        from PIL import Image, ImageDraw
+        
+        # Backend persistente: solo se captura el área del monitor/región elegida
+        monitor_region = self.capture_backend.monitor_region(monitor)
+        if region:
+            # Región vacía o fuera de pantalla: se usa el monitor completo
+            region = self.capture_backend.clip_region(region, monitor_region) or monitor_region
+        else:
+            region = monitor_region
+        img = self.capture_backend.grab(region, raw=True)
 
-            if img is None:
-                # Generar imagen de error informativa
-                img = Image.new('RGB', (800, 600), color=(50, 50, 80))
-                draw = ImageDraw.Draw(img)
-                
-                # Texto de error
-                msg = "⚠ No se puede capturar pantalla"
-                msg2 = "Wayland está bloqueando el acceso"
-                msg3 = "Inicia sesión en modo X11/Xorg"
-                
-                try:
-                    draw.text((200, 250), msg, fill=(255, 255, 255))
-                    draw.text((150, 290), msg2, fill=(200, 200, 200))
-                    draw.text((170, 330), msg3, fill=(150, 150, 150))
-                except:
-                    pass  # Si no hay fuentes, al menos enviamos la imagen de color
-                
-                method_used = 'error_image'
-                logger.error('Todos los métodos de captura fallaron')
-                
-            # Procesar la imagen (común para todos los métodos)
-            # Redimensionar si es necesario
-            if scale != 1.0:
-                new_width = int(img.width * scale)
-                new_height = int(img.height * scale)
-                img = img.resize((new_width, new_height), Image.Resampling.LANCZOS)
-            
-            # Convertir a JPEG y codificar en base64
-            buffer = io.BytesIO()
-            img.save(buffer, format='JPEG', quality=quality, optimize=True)
-            img_bytes = buffer.getvalue()
-            img_b64 = base64.b64encode(img_bytes).decode('utf-8')
+        if img is None:
+            # Generar imagen de error informativa
+            img = Image.new('RGB', (800, 600), color=(50, 50, 80))
+            draw = ImageDraw.Draw(img)
+            
+            # Texto de error
+            msg = "⚠ No se puede capturar pantalla"
+            msg2 = "Wayland está bloqueando el acceso"
+            msg3 = "Inicia sesión en modo X11/Xorg"
+            
+            try:
+                draw.text((200, 250), msg, fill=(255, 255, 255))
+                draw.text((150, 290), msg2, fill=(200, 200, 200))
+                draw.text((170, 330), msg3, fill=(150, 150, 150))
+            except:
+                pass  # Si no hay fuentes, al menos enviamos la imagen de color
+            
+        return img
+
+    def capture_screenshot(self, quality=80, scale=1.0, binary=False, resample='sharp', monitor=None, region=None,
+                           encoder='jpeg-optimized', metrics=None, frame=None):
+        """
+        Capturar screenshot de la pantalla de manera robusta
+        
+        Args:
+            quality: Calidad JPEG
+            scale: Factor de escala
+            binary: True para devolver el JPEG en bytes crudos en lugar de base64
+            resample: Nivel de remuestreo ('fast', 'balanced', 'sharp')
+            monitor: Índice de monitor, 'all' o None (área por defecto)
+            region: Rectángulo a capturar (relativo al monitor si se indica uno)
+            encoder: Nombre de codificador o FrameEncoder (ver frame_encoders.get_encoder)
+            metrics: StageMetrics opcional para medir cada etapa ('screenshot.*')
+            frame: Frame ya capturado (p. ej. del stream activo); si falta se captura
+            
+        Returns:
+            Dict con 'data', 'width', 'height', 'format', 'encoding', 'size' y 'encode_ms'
+        """
+        import base64
+        
+        metrics = metrics or StageMetrics()
+        try:
+            if isinstance(encoder, str):
+                encoder = get_encoder(encoder)
+            
+            if frame is None:
+                with metrics.time('screenshot.capture'):
+                    frame = self.capture_frame(monitor, region)
+            img = frame
+            if not (scale == 1.0 and encoder.accepts_raw):
+                with metrics.time('screenshot.resize'):
+                    img = scale_image(as_image(img), scale, resample)
+            
+            # Codificar (base64 solo como compatibilidad)
+            with metrics.time('screenshot.encode'):
+                encoded = encoder.encode(img, quality)
+            img_bytes = encoded['data']
+            if not binary:
+                with metrics.time('screenshot.base64'):
+                    img_bytes = base64.b64encode(img_bytes).decode('utf-8')
             
             return {
-                'data': img_b64,
+                'data': img_bytes,
                 'width': img.width,
-                'height': img.height
+                'height': img.height,
+                'format': encoded['format'],
+                'encoding': 'binary' if binary else 'base64',
+                'size': encoded['size'],
+                'encode_ms': round(encoded['encode_ms'], 2)
             }
                 
         except ImportError as e:
@@ -564,4 +577,4 @@ done
             return None
         except Exception as e:
             logger.error(f'Error capturando screenshot: {e}')
-            return None
\ No newline at end of file
+            return None
@@ -0,0 +1,703 @@
+"""
+Módulo de captura de pantalla
+Backend persistente: sondea una sola vez el método disponible y lo reutiliza en cada frame
+"""
+import io
+import os
+import re
+import json
+import select
+import shutil
+import logging
+import subprocess
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+
+class RawFrame:
+    """Frame BGRA sin convertir (mss): la conversión a PIL solo se hace si hace falta"""
+
+    def __init__(self, bgra, size):
+        """
+        Args:
+            bgra: Buffer BGRA del backend (bytearray de mss, sin copiar)
+            size: Tupla (ancho, alto)
+        """
+        self.bgra = bgra
+        self.size = size
+        self._image = None
+
+    @property
+    def width(self):
+        return self.size[0]
+
+    @property
+    def height(self):
+        return self.size[1]
+
+    @property
+    def array(self):
+        """Vista NumPy (alto, ancho, 4) del buffer, sin copia"""
+        import numpy as np
+        return np.frombuffer(self.bgra, dtype=np.uint8).reshape(self.size[1], self.size[0], 4)
+
+    @property
+    def image(self):
+        """Imagen PIL RGB (una sola conversión BGRX -> RGB, cacheada)"""
+        if self._image is None:
+            from PIL import Image
+            self._image = Image.frombuffer('RGB', self.size, self.bgra, 'raw', 'BGRX', 0, 1)
+        return self._image
+
+
+def as_image(frame):
+    """Imagen PIL de un frame capturado (RawFrame o imagen PIL)"""
+    if isinstance(frame, RawFrame):
+        return frame.image
+    return frame
+
+
+# Cabecera PPM binaria tal como la escribe grim: "P6\n<ancho> <alto>\n255\n"
+_PPM_HEADER = re.compile(rb'P6\s+(\d+)\s+(\d+)\s+(\d+)\s')
+
+
+def decode_ppm(data):
+    """
+    Imagen PIL de un PPM binario (P6): los píxeles ya son RGB, solo se envuelve el buffer
+
+    Args:
+        data: Bytes del PPM completo
+
+    Returns:
+        Imagen PIL RGB
+    """
+    from PIL import Image
+
+    match = _PPM_HEADER.match(data)
+    if match is None or int(match.group(3)) != 255:
+        img = Image.open(io.BytesIO(data))
+        img.load()
+        return img
+    size = (int(match.group(1)), int(match.group(2)))
+    return Image.frombuffer('RGB', size, memoryview(data)[match.end():], 'raw', 'RGB', 0, 1)
+
+
+class GrimHelper:
+    """Proceso auxiliar persistente que lanza grim bajo demanda
+
+    El fork se hace desde un shell pequeño en lugar de desde el proceso Python
+    (grande y con varios hilos), y el frame llega por un pipe ya abierto.
+    """
+
+    # Una línea por frame: '-' (área por defecto) o geometría 'x,y anchoxalto'
+    SCRIPT = (
+        'while IFS= read -r geometry; do '
+        'if [ "$geometry" = "-" ]; then grim -t ppm - || printf "ERR\\n"; '
+        'else grim -t ppm -g "$geometry" - || printf "ERR\\n"; fi; '
+        'done'
+    )
+
+    def __init__(self, timeout=2.0):
+        """
+        Args:
+            timeout: Segundos máximos de espera por frame
+        """
+        self.timeout = timeout
+        self._proc = None
+
+    def start(self):
+        """Arrancar el proceso auxiliar"""
+        if shutil.which('grim') is None:
+            raise FileNotFoundError('grim no está instalado')
+        self._proc = subprocess.Popen(['sh', '-c', self.SCRIPT],
+                                      stdin=subprocess.PIPE,
+                                      stdout=subprocess.PIPE,
+                                      stderr=subprocess.DEVNULL,
+                                      bufsize=0)
+
+    def capture(self, region=None):
+        """
+        Pedir un frame al proceso auxiliar
+
+        Args:
+            region: Dict {'left', 'top', 'width', 'height'} o None
+
+        Returns:
+            Imagen PIL RGB
+        """
+        if self._proc is None or self._proc.poll() is not None:
+            self.start()
+
+        geometry = '-'
+        if region:
+            geometry = f"{region['left']},{region['top']} {region['width']}x{region['height']}"
+        self._proc.stdin.write(f'{geometry}\n'.encode())
+
+        fd = self._proc.stdout.fileno()
+        deadline = time.monotonic() + self.timeout
+        buffer = bytearray()
+        total = None
+        while total is None or len(buffer) < total:
+            if total is None:
+                if buffer.startswith(b'ERR\n'):
+                    raise RuntimeError('grim falló')
+                match = _PPM_HEADER.match(buffer)
+                if match:
+                    if int(match.group(3)) != 255:
+                        self.close()
+                        raise RuntimeError('Formato PPM no soportado')
+                    total = match.end() + int(match.group(1)) * int(match.group(2)) * 3
+                    continue
+
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                # La respuesta quedaría a medias en el pipe: reiniciar el proceso
+                self.close()
+                raise TimeoutError('grim no respondió a tiempo')
+            ready, _, _ = select.select([fd], [], [], remaining)
+            if ready:
+                chunk = os.read(fd, 1 << 20)
+                if not chunk:
+                    self.close()
+                    raise RuntimeError('El proceso auxiliar de grim terminó')
+                buffer += chunk
+
+        return decode_ppm(buffer)
+
+    def close(self):
+        """Terminar el proceso auxiliar"""
+        if self._proc is None:
+            return
+        try:
+            self._proc.stdin.close()
+            self._proc.kill()
+            self._proc.wait(timeout=1)
+        except Exception:
+            pass
+        self._proc = None
+
+
+class CaptureBackend:
+    """Backend de captura de pantalla de larga duración"""
+
+    # Fallos consecutivos antes de cambiar de método
+    MAX_FAILURES = 3
+    # Segundos antes de volver a sondear si todos los métodos fallaron
+    RETRY_INTERVAL = 5.0
+
+    def __init__(self, wayland_session=False, persistent_grim=True):
+        """
+        Inicializar backend de captura
+
+        Args:
+            wayland_session: True si la sesión es Wayland (prioriza grim)
+            persistent_grim: Probar primero un proceso auxiliar de grim persistente
+        """
+        self.wayland_session = wayland_session
+        self.persistent_grim = persistent_grim
+        self.method = None
+        self.failures = 0
+
+        # Recursos persistentes del método elegido
+        self._sct = None
+        self._monitor = None
+        self._pyautogui = None
+        self._grim_helper = None
+        self._display_set = False
+        self._monitors = None
+
+        # Métodos descartados tras fallos repetidos
+        self._excluded = set()
+        self._exhausted_at = None
+        self._lock = threading.Lock()
+
+        # mss guarda el display X en threading.local: su handle solo funciona en el hilo
+        # que lo creó, así que todo el trabajo del backend se hace en un hilo dedicado
+        self._executor = None
+        self._executor_lock = threading.Lock()
+        self._capture_thread = None
+
+    def _mark_capture_thread(self):
+        self._capture_thread = threading.get_ident()
+
+    def _on_capture_thread(self, fn, *args):
+        """Ejecutar fn en el hilo de captura (directamente si ya se está en él)"""
+        if threading.get_ident() == self._capture_thread:
+            return fn(*args)
+        with self._executor_lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='screen-capture',
+                                                    initializer=self._mark_capture_thread)
+            executor = self._executor
+        return executor.submit(fn, *args).result()
+
+    def _candidate_methods(self):
+        """Orden de preferencia de métodos según la sesión"""
+        if self.wayland_session:
+            methods = ['grim', 'pyautogui', 'mss']
+            if self.persistent_grim:
+                methods.insert(0, 'grim-helper')
+        else:
+            methods = ['mss', 'pyautogui']
+        return [m for m in methods if m not in self._excluded]
+
+    def _ensure_display(self):
+        """Configurar DISPLAY una sola vez si no existe"""
+        if 'DISPLAY' not in os.environ:
+            os.environ['DISPLAY'] = ':0'
+            self._display_set = True
+
+    def _open(self, method):
+        """Abrir los recursos persistentes de un método"""
+        if method == 'mss':
+            import mss
+            self._ensure_display()
+            self._sct = mss.mss()
+            monitors = self._sct.monitors
+            self._monitor = monitors[1] if len(monitors) > 1 else monitors[0]
+        elif method == 'pyautogui':
+            self._ensure_display()
+            import pyautogui
+            self._pyautogui = pyautogui
+        elif method == 'grim-helper':
+            self._grim_helper = GrimHelper()
+            self._grim_helper.start()
+
+    def _release(self):
+        """Liberar los recursos del método actual"""
+        if self._sct is not None:
+            try:
+                self._sct.close()
+            except Exception:
+                pass
+        if self._grim_helper is not None:
+            self._grim_helper.close()
+        self._sct = None
+        self._monitor = None
+        self._pyautogui = None
+        self._grim_helper = None
+        self._monitors = None
+        self.method = None
+        self.failures = 0
+
+    def _grab_with(self, method, region=None, raw=False):
+        """
+        Capturar un frame con el método indicado
+
+        Args:
+            method: 'grim-helper', 'grim', 'mss' o 'pyautogui'
+            region: Dict {'left', 'top', 'width', 'height'} o None para el área por defecto
+            raw: Devolver RawFrame (BGRA sin convertir) si el método lo permite
+        """
+        if method == 'grim-helper':
+            return self._grim_helper.capture(region)
+
+        if method == 'grim':
+            # grim escribe PPM sin comprimir a stdout: sin archivo temporal ni PNG
+            cmd = ['grim', '-t', 'ppm']
+            if region:
+                cmd += ['-g', f"{region['left']},{region['top']} {region['width']}x{region['height']}"]
+            cmd.append('-')
+            result = subprocess.run(cmd,
+                                    check=True,
+                                    timeout=2,
+                                    stdout=subprocess.PIPE,
+                                    stderr=subprocess.DEVNULL)
+            return decode_ppm(result.stdout)
+
+        if method == 'mss':
+            screenshot = self._sct.grab(region or self._monitor)
+            frame = RawFrame(screenshot.raw, tuple(screenshot.size))
+            # BGRX -> RGB en una sola pasada de PIL (sin la copia intermedia de .rgb)
+            return frame if raw else frame.image
+
+        if method == 'pyautogui':
+            if region:
+                return self._pyautogui.screenshot(region=(region['left'], region['top'],
+                                                          region['width'], region['height']))
+            return self._pyautogui.screenshot()
+
+        raise ValueError(f'Método de captura desconocido: {method}')
+
+    def _probe(self):
+        """Sondear métodos en orden y quedarse con el primero que funcione"""
+        if self._exhausted_at is not None:
+            if time.monotonic() - self._exhausted_at < self.RETRY_INTERVAL:
+                return None
+            self._excluded.clear()
+            self._exhausted_at = None
+
+        for method in self._candidate_methods():
+            try:
+                self._open(method)
+                img = self._grab_with(method)
+                self.method = method
+                self.failures = 0
+                logger.info(f'Backend de captura seleccionado: {method}')
+                return img
+            except FileNotFoundError:
+                # Herramienta no instalada (grim)
+                self._excluded.add(method)
+            except Exception as e:
+                logger.warning(f'Fallo sondeando {method}: {e}')
+                self._excluded.add(method)
+            self._release()
+
+        logger.error('Todos los métodos de captura fallaron')
+        self._exhausted_at = time.monotonic()
+        return None
+
+    def grab(self, region=None, raw=False):
+        """
+        Capturar un frame con el método persistente
+
+        Args:
+            region: Dict {'left', 'top', 'width', 'height'}; solo se captura esa área
+            raw: Devolver RawFrame BGRA cuando el backend lo permite (mss)
+
+        Returns:
+            Imagen PIL (o RawFrame) o None si no hay método disponible
+        """
+        return self._on_capture_thread(self._grab, region, raw)
+
+    def _grab(self, region, raw):
+        with self._lock:
+            if self.method is None:
+                img = self._probe()
+                if img is None or (region is None and not raw):
+                    return img
+
+            try:
+                img = self._grab_with(self.method, region, raw)
+                self.failures = 0
+                return img
+            except Exception as e:
+                self.failures += 1
+                logger.warning(f'Fallo capturando con {self.method} ({self.failures}/{self.MAX_FAILURES}): {e}')
+                if self.failures >= self.MAX_FAILURES:
+                    logger.warning(f'Descartando backend de captura {self.method}')
+                    self._excluded.add(self.method)
+                    self._release()
+
+            # Este frame se intenta con los demás métodos antes de darlo por perdido
+            return self._grab_fallback(region, raw)
+
+    def _grab_fallback(self, region=None, raw=False):
+        """
+        Capturar un frame con los métodos alternativos, sin cambiar el persistente
+
+        Returns:
+            Imagen o None si todos los métodos fallaron
+        """
+        for method in self._candidate_methods():
+            # El auxiliar de grim es persistente: su versión puntual es 'grim'
+            if method in (self.method, 'grim-helper'):
+                continue
+            try:
+                img = self._grab_once(method, region, raw)
+                logger.info(f'Frame capturado con el método alternativo {method}')
+                return img
+            except Exception as e:
+                logger.debug(f'Fallo capturando con {method}: {e}')
+        return None
+
+    def _grab_once(self, method, region=None, raw=False):
+        """Captura puntual con un método, sin abrir recursos persistentes"""
+        if method == 'mss':
+            import mss
+            self._ensure_display()
+            # Handle de vida corta: se crea y se cierra en este mismo hilo
+            with mss.mss() as sct:
+                monitors = sct.monitors
+                screenshot = sct.grab(region or (monitors[1] if len(monitors) > 1 else monitors[0]))
+            frame = RawFrame(screenshot.raw, tuple(screenshot.size))
+            return frame if raw else frame.image
+
+        if method == 'pyautogui':
+            self._ensure_display()
+            import pyautogui
+            if region:
+                return pyautogui.screenshot(region=(region['left'], region['top'],
+                                                    region['width'], region['height']))
+            return pyautogui.screenshot()
+
+        return self._grab_with(method, region, raw)
+
+    def _wayland_outputs(self):
+        """Geometría de salidas en Wayland (sway/wlroots); lista vacía si no se puede"""
+        commands = [
+            (['swaymsg', '-t', 'get_outputs', '-r'], 'sway'),
+            (['wlr-randr', '--json'], 'wlr-randr')
+        ]
+        for cmd, kind in commands:
+            try:
+                result = subprocess.run(cmd, capture_output=True, text=True, timeout=2)
+                if result.returncode != 0:
+                    continue
+                outputs = []
+                for output in json.loads(result.stdout):
+                    if kind == 'sway':
+                        if not output.get('active', True):
+                            continue
+                        rect = output['rect']
+                        outputs.append({'name': output['name'], 'left': rect['x'], 'top': rect['y'],
+                                        'width': rect['width'], 'height': rect['height']})
+                    else:
+                        if not output.get('enabled', True):
+                            continue
+                        mode = next((m for m in output.get('modes', []) if m.get('current')), None)
+                        if mode is None:
+                            continue
+                        pos = output.get('position', {})
+                        scale = output.get('scale') or 1.0
+                        outputs.append({'name': output['name'], 'left': pos.get('x', 0), 'top': pos.get('y', 0),
+                                        'width': int(mode['width'] / scale), 'height': int(mode['height'] / scale)})
+                return outputs
+            except (FileNotFoundError, subprocess.TimeoutExpired, ValueError, KeyError):
+                continue
+        return []
+
+    def _enumerate_monitors(self):
+        """Lista de monitores estilo mss: índice 0 = todos, 1..N = cada monitor"""
+        if self._sct is not None:
+            return [dict(m) for m in self._sct.monitors]
+
+        outputs = self._wayland_outputs() if self.wayland_session else []
+        if not outputs and self._pyautogui is not None:
+            width, height = self._pyautogui.size()
+            outputs = [{'left': 0, 'top': 0, 'width': width, 'height': height}]
+        return self._combine_outputs(outputs)
+
+    @staticmethod
+    def _combine_outputs(outputs):
+        """Anteponer el rectángulo que cubre todas las salidas (índice 0)"""
+        if not outputs:
+            return []
+
+        left = min(o['left'] for o in outputs)
+        top = min(o['top'] for o in outputs)
+        right = max(o['left'] + o['width'] for o in outputs)
+        bottom = max(o['top'] + o['height'] for o in outputs)
+        combined = {'left': left, 'top': top, 'width': right - left, 'height': bottom - top}
+        return [combined] + outputs
+
+    def list_monitors(self, refresh=False):
+        """
+        Enumerar la geometría de los monitores
+
+        Args:
+            refresh: Volver a consultar en lugar de usar la caché
+
+        Returns:
+            Lista de dicts con 'index', 'left', 'top', 'width', 'height' (índice 0 = todos)
+        """
+        return self._on_capture_thread(self._list_monitors, refresh)
+
+    def _list_monitors(self, refresh):
+        with self._lock:
+            if self.method is None:
+                self._probe()
+            if self._monitors is None or refresh:
+                self._monitors = []
+                for index, monitor in enumerate(self._enumerate_monitors()):
+                    monitor['index'] = index
+                    self._monitors.append(monitor)
+            return [dict(m) for m in self._monitors]
+
+    def peek_monitors(self):
+        """
+        Geometría de los monitores sin sondear el backend (no captura ni arranca grim)
+
+        En Wayland se consulta sway/wlr-randr; en X11 se abre un mss de vida corta en
+        el hilo que llama (su display solo sirve en ese hilo) y se cierra al momento.
+
+        Returns:
+            Lista como la de list_monitors(); vacía si no se puede leer
+        """
+        with self._lock:
+            if self._monitors is not None:
+                return [dict(m) for m in self._monitors]
+        try:
+            if self.wayland_session:
+                monitors = self._combine_outputs(self._wayland_outputs())
+            else:
+                import mss
+                self._ensure_display()
+                with mss.mss() as sct:
+                    monitors = [dict(m) for m in sct.monitors]
+        except Exception as e:
+            logger.info(f'No se pudo leer la geometría de los monitores: {e}')
+            return []
+        for index, monitor in enumerate(monitors):
+            monitor['index'] = index
+        return monitors
+
+    def monitor_region(self, monitor=None):
+        """
+        Traducir una selección de monitor a la región a capturar
+
+        Args:
+            monitor: None (área por defecto del backend), 'all' o índice 1..N
+
+        Returns:
+            Dict de región o None para el área por defecto
+        """
+        if monitor is None:
+            return None
+        monitors = self.list_monitors()
+        if not monitors:
+            return None
+
+        try:
+            index = 0 if monitor == 'all' else int(monitor)
+        except (TypeError, ValueError):
+            index = -1
+        if index < 0 or index >= len(monitors):
+            logger.warning(f'Monitor {monitor} no existe, usando el área por defecto')
+            return None
+        selected = monitors[index]
+        return {key: selected[key] for key in ('left', 'top', 'width', 'height')}
+
+    def clip_region(self, region, origin=None):
+        """
+        Ajustar una región a los límites del escritorio
+
+        Args:
+            region: Dict de región; con 'absolute' ya está en coordenadas del escritorio
+                    (p. ej. la geometría de una ventana) y no se desplaza
+            origin: Región del monitor si 'region' es relativa a él
+
+        Returns:
+            Región recortada o None si queda vacía
+        """
+        left, top = region['left'], region['top']
+        if origin and not region.get('absolute'):
+            left += origin['left']
+            top += origin['top']
+        right = left + region['width']
+        bottom = top + region['height']
+
+        # Recortar contra el escritorio completo (fuera de él X11 devuelve BadMatch)
+        monitors = self.list_monitors()
+        if monitors:
+            bounds = origin or monitors[0]
+            left = max(left, bounds['left'])
+            top = max(top, bounds['top'])
+            right = min(right, bounds['left'] + bounds['width'])
+            bottom = min(bottom, bounds['top'] + bounds['height'])
+
+        if right <= left or bottom <= top:
+            return None
+        return {'left': left, 'top': top, 'width': right - left, 'height': bottom - top}
+
+    def reset(self):
+        """Volver a sondear todos los métodos desde cero"""
+        self._on_capture_thread(self._reset)
+
+    def _reset(self):
+        with self._lock:
+            self._release()
+            self._excluded.clear()
+            self._exhausted_at = None
+
+    def close(self):
+        """Liberar recursos, restaurar DISPLAY y terminar el hilo de captura"""
+        self._on_capture_thread(self._close)
+        with self._executor_lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False)
+
+    def _close(self):
+        with self._lock:
+            self._release()
+            if self._display_set and 'DISPLAY' in os.environ:
+                del os.environ['DISPLAY']
+            self._display_set = False
+
+
+class CaptureRegion:
+    """Región de captura de un stream: rectángulo fijo o ventana X11 seguida en caliente"""
+
+    # Segundos entre consultas de la geometría de la ventana
+    WINDOW_REFRESH = 1.0
+
+    def __init__(self, rect=None, window_id=None):
+        """
+        Inicializar región
+
+        Args:
+            rect: Dict con 'left'/'x', 'top'/'y', 'width', 'height'
+            window_id: ID de ventana X11 (decimal o '0x...')
+        """
+        self._lock = threading.Lock()
+        self._rect = None
+        self._window_id = None
+        self._window_checked_at = 0.0
+        self.update(rect, window_id)
+
+    @staticmethod
+    def normalize(rect):
+        """Convertir un rectángulo del servidor al formato de región de captura"""
+        left = int(rect.get('left', rect.get('x', 0)))
+        top = int(rect.get('top', rect.get('y', 0)))
+        width = int(rect['width'])
+        height = int(rect['height'])
+        if width <= 0 or height <= 0:
+            raise ValueError('La región debe tener ancho y alto positivos')
+        return {'left': left, 'top': top, 'width': width, 'height': height}
+
+    def update(self, rect=None, window_id=None):
+        """Cambiar la región (se aplica en el siguiente frame)"""
+        with self._lock:
+            self._window_id = str(window_id) if window_id is not None else None
+            self._rect = self.normalize(rect) if rect else None
+            self._window_checked_at = 0.0
+
+    def _window_geometry(self):
+        """Geometría absoluta de la ventana con xwininfo (marcada 'absolute': no es relativa al monitor)"""
+        result = subprocess.run(['xwininfo', '-id', self._window_id],
+                                capture_output=True, text=True, timeout=2)
+        if result.returncode != 0:
+            raise RuntimeError(f'Ventana {self._window_id} no encontrada')
+
+        fields = {}
+        for line in result.stdout.splitlines():
+            key, _, value = line.strip().partition(':')
+            fields[key] = value.strip()
+        return {
+            'left': int(fields['Absolute upper-left X']),
+            'top': int(fields['Absolute upper-left Y']),
+            'width': int(fields['Width']),
+            'height': int(fields['Height']),
+            'absolute': True
+        }
+
+    def resolve(self):
+        """
+        Región actual a capturar
+
+        Returns:
+            Dict de región o None (pantalla completa)
+        """
+        with self._lock:
+            if self._window_id is not None:
+                now = time.monotonic()
+                if self._rect is None or now - self._window_checked_at >= self.WINDOW_REFRESH:
+                    self._window_checked_at = now
+                    try:
+                        self._rect = self._window_geometry()
+                    except Exception as e:
+                        logger.warning(f'No se pudo obtener la geometría de la ventana: {e}')
+            return dict(self._rect) if self._rect else None
+
+    def describe(self):
+        """Descripción de la región para los metadatos del frame"""
+        with self._lock:
+            return {
+                'window_id': self._window_id,
+                'rect': dict(self._rect) if self._rect else None
+            }
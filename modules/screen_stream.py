@@ -0,0 +1,992 @@
+"""
+Módulo de streaming de pantalla
+Pipeline captura → codificación → envío, codificación delta por tiles,
+control adaptativo de calidad/FPS y captura compartida entre sesiones
+"""
+import time
+import logging
+import hashlib
+import weakref
+import threading
+from collections import deque, OrderedDict
+
+from .frame_encoders import get_encoder
+from .stream_metrics import StageMetrics
+from .screen_capture import as_image
+
+logger = logging.getLogger(__name__)
+
+
+class TileDeltaEncoder:
+    """Codificador delta: divide el frame en tiles y solo envía los que cambiaron"""
+
+    def __init__(self, tile_size=64, keyframe_interval=10.0, max_changed_ratio=0.5, encoder='jpeg'):
+        """
+        Inicializar codificador delta
+
+        Args:
+            tile_size: Tamaño en píxeles de cada tile cuadrado
+            keyframe_interval: Segundos entre keyframes completos
+            max_changed_ratio: Fracción de tiles cambiados a partir de la cual
+                               sale más barato enviar un keyframe
+            encoder: Nombre del codificador de imagen (ver frame_encoders)
+        """
+        self.encoder = get_encoder(encoder)
+        self.tile_size = max(8, int(tile_size))
+        self.keyframe_interval = keyframe_interval
+        self.max_changed_ratio = max_changed_ratio
+
+        self._previous = None
+        self._last_keyframe = 0.0
+        self._force_keyframe = True
+
+    def request_keyframe(self):
+        """Forzar un keyframe en el próximo frame (p. ej. nuevo viewer)"""
+        self._force_keyframe = True
+
+    def changed_tiles(self, previous, current):
+        """
+        Detectar tiles cambiados con una comparación vectorizada
+
+        Args:
+            previous: Array (alto, ancho, canales) del frame anterior
+            current: Array (alto, ancho, canales) del frame actual
+
+        Returns:
+            Matriz booleana (filas, columnas) de tiles cambiados
+        """
+        import numpy as np
+
+        ts = self.tile_size
+        height, width, channels = current.shape
+
+        # Comparar bytes en 2D (alto, ancho*canales) y reducir por bloques
+        diff = (previous != current).reshape(height, width * channels)
+        diff = np.logical_or.reduceat(diff, np.arange(0, height, ts), axis=0)
+        return np.logical_or.reduceat(diff, np.arange(0, width * channels, ts * channels), axis=1)
+
+    def changed_rects(self, changed, width, height):
+        """
+        Agrupar tiles cambiados contiguos de cada fila en rectángulos
+
+        Returns:
+            Lista de tuplas (x, y, ancho, alto) en píxeles
+        """
+        ts = self.tile_size
+        rects = []
+        for row, row_tiles in enumerate(changed):
+            col = 0
+            cols = len(row_tiles)
+            while col < cols:
+                if not row_tiles[col]:
+                    col += 1
+                    continue
+                start = col
+                while col < cols and row_tiles[col]:
+                    col += 1
+                x = start * ts
+                y = row * ts
+                rects.append((x, y, min(col * ts, width) - x, min(y + ts, height) - y))
+        return rects
+
+    def encode(self, img, quality=60):
+        """
+        Codificar un frame como keyframe o como delta de tiles
+
+        Args:
+            img: Imagen PIL del frame actual
+            quality: Calidad JPEG
+
+        Returns:
+            Dict con 'type' ('keyframe' o 'delta'), dimensiones, formato y datos
+        """
+        import numpy as np
+
+        if img.mode != 'RGB':
+            img = img.convert('RGB')
+        current = np.asarray(img)
+        height, width = current.shape[:2]
+        now = time.monotonic()
+
+        needs_keyframe = (
+            self._force_keyframe
+            or self._previous is None
+            or self._previous.shape != current.shape
+            or now - self._last_keyframe >= self.keyframe_interval
+        )
+
+        if not needs_keyframe:
+            changed = self.changed_tiles(self._previous, current)
+            if changed.mean() > self.max_changed_ratio:
+                needs_keyframe = True
+
+        self._previous = current
+
+        if needs_keyframe:
+            self._force_keyframe = False
+            self._last_keyframe = now
+            encoded = self.encoder.encode(img, quality)
+            return {
+                'type': 'keyframe',
+                'width': width,
+                'height': height,
+                'format': encoded['format'],
+                'data': encoded['data']
+            }
+
+        tiles = []
+        for x, y, w, h in self.changed_rects(changed, width, height):
+            encoded = self.encoder.encode(img.crop((x, y, x + w, y + h)), quality)
+            tiles.append({
+                'x': x,
+                'y': y,
+                'w': w,
+                'h': h,
+                'format': encoded['format'],
+                'data': encoded['data']
+            })
+
+        return {
+            'type': 'delta',
+            'width': width,
+            'height': height,
+            'tile_size': self.tile_size,
+            'tiles': tiles
+        }
+
+
+class AdaptiveStreamController:
+    """Ajusta calidad, escala y FPS del stream para mantener una latencia objetivo"""
+
+    # Segundos mínimos entre ajustes
+    ADJUST_INTERVAL = 1.0
+    # Segundos tras los cuales un frame sin confirmar se considera perdido
+    ACK_TIMEOUT = 5.0
+    # Suavizado de las medias móviles exponenciales
+    EWMA_ALPHA = 0.2
+
+    QUALITY_STEP = 10
+    SCALE_FACTOR = 0.8
+    FPS_FACTOR = 0.75
+
+    def __init__(self, quality=60, scale=0.5, fps=10, bounds=None, target_latency_ms=250):
+        """
+        Inicializar controlador adaptativo
+
+        Args:
+            quality: Calidad JPEG inicial
+            scale: Escala inicial
+            fps: FPS iniciales
+            bounds: Límites dados por el servidor (min_/max_ quality, scale, fps)
+            target_latency_ms: Latencia objetivo (ida y vuelta) en milisegundos
+        """
+        bounds = bounds or {}
+        self.min_quality = bounds.get('min_quality', 20)
+        self.max_quality = bounds.get('max_quality', quality)
+        self.min_scale = bounds.get('min_scale', 0.25)
+        self.max_scale = bounds.get('max_scale', scale)
+        self.min_fps = bounds.get('min_fps', 2)
+        self.max_fps = bounds.get('max_fps', fps)
+        self.target_latency_ms = target_latency_ms
+
+        self.quality = self._clamp(quality, self.min_quality, self.max_quality)
+        self.scale = self._clamp(scale, self.min_scale, self.max_scale)
+        self.fps = self._clamp(fps, self.min_fps, self.max_fps)
+
+        # Medidas (medias móviles)
+        self.encode_ms = None
+        self.payload_bytes = None
+        self.rtt_ms = None
+
+        self._in_flight = {}
+        self._acks_seen = False
+        self._lost = 0
+        self._last_adjust = time.monotonic()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _clamp(value, low, high):
+        return max(low, min(high, value))
+
+    def _ewma(self, current, sample):
+        if current is None:
+            return sample
+        return current + self.EWMA_ALPHA * (sample - current)
+
+    def frame_sent(self, seq, payload_bytes, encode_ms):
+        """Registrar un frame enviado con su tamaño y tiempo de codificación"""
+        with self._lock:
+            self.encode_ms = self._ewma(self.encode_ms, encode_ms)
+            self.payload_bytes = self._ewma(self.payload_bytes, payload_bytes)
+            self._in_flight[seq] = time.monotonic()
+
+    def frame_acked(self, seq):
+        """Registrar la confirmación del servidor para un frame"""
+        with self._lock:
+            sent_at = self._in_flight.pop(seq, None)
+            if sent_at is None:
+                return
+            self._acks_seen = True
+            self.rtt_ms = self._ewma(self.rtt_ms, (time.monotonic() - sent_at) * 1000)
+
+    def _expire_in_flight(self, now):
+        """Descartar frames sin confirmar tras ACK_TIMEOUT"""
+        expired = [seq for seq, sent_at in self._in_flight.items()
+                   if now - sent_at > self.ACK_TIMEOUT]
+        for seq in expired:
+            del self._in_flight[seq]
+        if self._acks_seen:
+            self._lost += len(expired)
+
+    def _estimated_latency_ms(self, now):
+        """Latencia estimada: RTT medio o la edad del frame pendiente más antiguo"""
+        latency = self.rtt_ms or 0.0
+        if self._acks_seen and self._in_flight:
+            oldest = min(self._in_flight.values())
+            latency = max(latency, (now - oldest) * 1000)
+        return latency
+
+    def _degrade(self):
+        """Bajar calidad, luego escala y por último FPS"""
+        if self.quality > self.min_quality:
+            self.quality = self._clamp(self.quality - self.QUALITY_STEP, self.min_quality, self.max_quality)
+        elif self.scale > self.min_scale:
+            self.scale = round(self._clamp(self.scale * self.SCALE_FACTOR, self.min_scale, self.max_scale), 3)
+        elif self.fps > self.min_fps:
+            self.fps = self._clamp(self.fps * self.FPS_FACTOR, self.min_fps, self.max_fps)
+        else:
+            return False
+        return True
+
+    def _upgrade(self):
+        """Recuperar FPS, luego escala y por último calidad"""
+        if self.fps < self.max_fps:
+            self.fps = self._clamp(self.fps / self.FPS_FACTOR, self.min_fps, self.max_fps)
+        elif self.scale < self.max_scale:
+            self.scale = round(self._clamp(self.scale / self.SCALE_FACTOR, self.min_scale, self.max_scale), 3)
+        elif self.quality < self.max_quality:
+            self.quality = self._clamp(self.quality + self.QUALITY_STEP, self.min_quality, self.max_quality)
+        else:
+            return False
+        return True
+
+    def update(self):
+        """
+        Reajustar los parámetros del stream según las medidas recientes
+
+        Returns:
+            True si cambió algún parámetro
+        """
+        with self._lock:
+            now = time.monotonic()
+            if now - self._last_adjust < self.ADJUST_INTERVAL:
+                return False
+            self._last_adjust = now
+
+            self._expire_in_flight(now)
+            latency = self._estimated_latency_ms(now)
+            frame_budget_ms = 1000.0 / self.fps
+
+            # Sin confirmaciones del servidor solo se controla el coste de CPU
+            congested = self._acks_seen and (latency > self.target_latency_ms * 1.25 or self._lost > 0)
+            cpu_bound = self.encode_ms is not None and self.encode_ms > frame_budget_ms * 0.9
+            self._lost = 0
+
+            if congested or cpu_bound:
+                changed = self._degrade()
+            elif ((not self._acks_seen or latency < self.target_latency_ms * 0.5)
+                  and (self.encode_ms is None or self.encode_ms < frame_budget_ms * 0.5)):
+                changed = self._upgrade()
+            else:
+                changed = False
+
+            if changed:
+                logger.info(f'🎚️ Stream adaptativo: quality={self.quality}, scale={self.scale}, '
+                            f'fps={self.fps:.1f} (latencia {latency:.0f} ms)')
+            return changed
+
+    def settings(self):
+        """Parámetros actuales y medidas para incluir en los metadatos del frame"""
+        with self._lock:
+            return {
+                'quality': self.quality,
+                'scale': self.scale,
+                'fps': round(self.fps, 2),
+                'target_latency_ms': self.target_latency_ms,
+                'rtt_ms': round(self.rtt_ms, 1) if self.rtt_ms is not None else None,
+                'encode_ms': round(self.encode_ms, 1) if self.encode_ms is not None else None,
+                'payload_bytes': int(self.payload_bytes) if self.payload_bytes is not None else None
+            }
+
+
+class FramePacer:
+    """Ritmo de frames por deadlines monotónicos (sin deriva acumulada)"""
+
+    # Ticks recientes usados para calcular FPS reales y jitter
+    WINDOW = 60
+
+    def __init__(self, fps=10):
+        self._fps = max(0.1, float(fps))
+        self._next_deadline = None
+        self._ticks = deque(maxlen=self.WINDOW)
+        self._lateness = deque(maxlen=self.WINDOW)
+        self.skipped = 0
+
+    @property
+    def fps(self):
+        return self._fps
+
+    @fps.setter
+    def fps(self, value):
+        value = max(0.1, float(value))
+        if value != self._fps:
+            self._fps = value
+            # Reprogramar desde ahora con el nuevo intervalo
+            self._next_deadline = None
+
+    def wait(self, should_continue=None):
+        """
+        Esperar hasta el próximo deadline
+
+        Si la captura anterior se pasó de uno o más deadlines, se saltan
+        esos frames limpiamente en lugar de acumular retraso.
+
+        Args:
+            should_continue: Función opcional; si devuelve False se deja de esperar
+        """
+        interval = 1.0 / self._fps
+        now = time.monotonic()
+
+        if self._next_deadline is None:
+            self._next_deadline = now
+        else:
+            while now < self._next_deadline:
+                if should_continue is not None and not should_continue():
+                    return
+                time.sleep(min(self._next_deadline - now, 0.5))
+                now = time.monotonic()
+
+        self._lateness.append(now - self._next_deadline)
+        self._ticks.append(now)
+
+        self._next_deadline += interval
+        if now >= self._next_deadline:
+            missed = int((now - self._next_deadline) / interval) + 1
+            self.skipped += missed
+            self._next_deadline += missed * interval
+
+    def stats(self):
+        """FPS logrados, jitter y frames saltados en la ventana reciente"""
+        achieved_fps = 0.0
+        if len(self._ticks) > 1:
+            elapsed = self._ticks[-1] - self._ticks[0]
+            if elapsed > 0:
+                achieved_fps = (len(self._ticks) - 1) / elapsed
+
+        jitter_ms = 0.0
+        if self._lateness:
+            mean = sum(self._lateness) / len(self._lateness)
+            jitter_ms = (sum((x - mean) ** 2 for x in self._lateness) / len(self._lateness)) ** 0.5 * 1000
+
+        return {
+            'target_fps': round(self._fps, 2),
+            'achieved_fps': round(achieved_fps, 2),
+            'jitter_ms': round(jitter_ms, 2),
+            'skipped_deadlines': self.skipped
+        }
+
+
+class FrameChangeDetector:
+    """Huella barata de frame (gris reducido) para saltar frames idénticos antes de codificar"""
+
+    def __init__(self, sample_factor=8):
+        """
+        Inicializar detector
+
+        Args:
+            sample_factor: Factor de reducción antes de calcular la huella
+        """
+        self.sample_factor = max(1, int(sample_factor))
+        self._last = None
+
+    def fingerprint(self, img):
+        """Hash de una versión reducida en escala de grises del frame"""
+        # reduce() promedia bloques completos: un cambio de pocos píxeles (un carácter,
+        # el cursor de texto) altera la huella, cosa que un muestreo con salto no garantiza.
+        # En un RawFrame la conversión a PIL queda cacheada para el codificador
+        img = as_image(img)
+        small = img
+        if min(img.size) >= self.sample_factor * 8:
+            small = img.reduce(self.sample_factor)
+        return hashlib.blake2b(small.convert('L').tobytes(), digest_size=8).digest()
+
+    def has_changed(self, img):
+        """True si el frame difiere del anterior"""
+        fingerprint = self.fingerprint(img)
+        changed = fingerprint != self._last
+        self._last = fingerprint
+        return changed
+
+    def reset(self):
+        """Olvidar la última huella: el próximo frame cuenta como cambiado"""
+        self._last = None
+
+
+class LatestFrameSlot:
+    """Cola de un solo hueco: un frame nuevo reemplaza al pendiente (latest-frame-wins)"""
+
+    def __init__(self, lossless=False):
+        """
+        Args:
+            lossless: En lugar de reemplazar el pendiente, esperar a que lo recojan
+                      (para paquetes que no se pueden perder, como los deltas)
+        """
+        self._cond = threading.Condition()
+        self._item = None
+        self._has_item = False
+        self._closed = False
+        self.lossless = lossless
+        self.dropped = 0
+
+    def put(self, item):
+        """Depositar un frame descartando el anterior si nadie lo recogió"""
+        with self._cond:
+            if self.lossless:
+                while self._has_item and not self._closed:
+                    self._cond.wait()
+                if self._closed:
+                    return
+            if self._has_item:
+                self.dropped += 1
+            self._item = item
+            self._has_item = True
+            self._cond.notify()
+
+    def get(self, timeout=0.5):
+        """
+        Recoger el frame pendiente
+
+        Returns:
+            El frame o None si no llegó ninguno en 'timeout' o la cola se cerró
+        """
+        with self._cond:
+            if not self._has_item and not self._closed:
+                self._cond.wait(timeout)
+            if not self._has_item:
+                return None
+            item = self._item
+            self._item = None
+            self._has_item = False
+            # Despertar a un productor sin pérdidas que espera el hueco
+            self._cond.notify_all()
+            return item
+
+    def close(self):
+        """Cerrar la cola y despertar a quien espera"""
+        with self._cond:
+            self._closed = True
+            self._item = None
+            self._has_item = False
+            self._cond.notify_all()
+
+
+class ScreenStreamPipeline:
+    """Pipeline de stream en tres threads: captura → codificación → envío"""
+
+    def __init__(self, capture, encode, send, fps=10,
+                 change_detector=None, keepalive=None, keepalive_interval=2.0, lossless_send=False):
+        """
+        Inicializar pipeline
+
+        Args:
+            capture: Función sin argumentos que devuelve un frame (o None)
+            encode: Función frame -> paquete codificado (o None para no enviar)
+            send: Función paquete -> emite al servidor
+            fps: Frecuencia de captura (modificable en caliente)
+            change_detector: FrameChangeDetector para saltar frames sin cambios
+            keepalive: Función llamada si no se envía nada en 'keepalive_interval'
+            keepalive_interval: Segundos sin envíos antes de un keepalive
+            lossless_send: No descartar paquetes ya codificados (modo delta: el codificador
+                           ya avanzó su estado y perder un delta corrompe la imagen). El
+                           backpressure se traslada a la captura, que descarta frames crudos
+        """
+        self.capture = capture
+        self.encode = encode
+        self.send = send
+        self.pacer = FramePacer(fps)
+        self.change_detector = change_detector
+        self.keepalive = keepalive
+        self.keepalive_interval = keepalive_interval
+
+        self.frames_captured = 0
+        self.frames_unchanged = 0
+        self.frames_encoded = 0
+        self.frames_sent = 0
+        self.keepalives_sent = 0
+        self._last_output = time.monotonic()
+
+        self.running = False
+        self._encode_slot = LatestFrameSlot()
+        self._send_slot = LatestFrameSlot(lossless=lossless_send)
+        self._threads = []
+
+    @property
+    def fps(self):
+        return self.pacer.fps
+
+    @fps.setter
+    def fps(self, value):
+        self.pacer.fps = value
+
+    @property
+    def frames_dropped(self):
+        """Frames descartados por backpressure entre etapas"""
+        return self._encode_slot.dropped + self._send_slot.dropped
+
+    def start(self):
+        """Arrancar los tres threads del pipeline"""
+        self.running = True
+        self._threads = [
+            threading.Thread(target=self._capture_loop, name='stream-capture', daemon=True),
+            threading.Thread(target=self._encode_loop, name='stream-encode', daemon=True),
+            threading.Thread(target=self._send_loop, name='stream-send', daemon=True)
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    def stop(self):
+        """Detener el pipeline y despertar a las etapas bloqueadas"""
+        self.running = False
+        self._encode_slot.close()
+        self._send_slot.close()
+
+    def join(self, timeout=None):
+        """Esperar a que terminen los threads"""
+        for thread in self._threads:
+            if thread is not threading.current_thread():
+                thread.join(timeout)
+
+    def _handle_error(self, stage, e):
+        """Registrar un error de etapa; detiene el pipeline si es fatal"""
+        logger.error(f'❌ Error en stream ({stage}): {e}')
+        # Si es un error fatal de X11/Wayland, detener el stream para evitar crash loop
+        if "BadMatch" in str(e) or "X_GetImage" in str(e):
+            logger.critical("Error fatal de gráficos detectado. Deteniendo stream.")
+            self.stop()
+            return
+        import traceback
+        logger.error(traceback.format_exc())
+        time.sleep(1)  # Esperar un poco antes de reintentar
+
+    def stats(self):
+        """Contadores del pipeline y métricas de ritmo"""
+        stats = self.pacer.stats()
+        stats.update({
+            'frames_captured': self.frames_captured,
+            'frames_unchanged': self.frames_unchanged,
+            'frames_encoded': self.frames_encoded,
+            'frames_sent': self.frames_sent,
+            'frames_dropped': self.frames_dropped,
+            'keepalives_sent': self.keepalives_sent
+        })
+        return stats
+
+    def _capture_loop(self):
+        while self.running:
+            self.pacer.wait(lambda: self.running)
+            if not self.running:
+                break
+            try:
+                frame = self.capture()
+                if frame is None:
+                    logger.warning('⚠️  Screenshot es None en el stream')
+                    continue
+                self.frames_captured += 1
+
+                if self.change_detector and not self.change_detector.has_changed(frame):
+                    self.frames_unchanged += 1
+                    self._maybe_keepalive()
+                    continue
+                self._encode_slot.put(frame)
+            except Exception as e:
+                self._handle_error('captura', e)
+
+    def _maybe_keepalive(self):
+        """Enviar un keepalive si lleva demasiado tiempo sin salir nada"""
+        if self.keepalive is None:
+            return
+        now = time.monotonic()
+        if now - self._last_output >= self.keepalive_interval:
+            self._last_output = now
+            self.keepalive()
+            self.keepalives_sent += 1
+
+    def _encode_loop(self):
+        while self.running:
+            frame = self._encode_slot.get()
+            if frame is None:
+                continue
+            try:
+                packet = self.encode(frame)
+            except Exception as e:
+                self._handle_error('codificación', e)
+                continue
+            if packet is not None:
+                self.frames_encoded += 1
+                self._send_slot.put(packet)
+
+    def _send_loop(self):
+        while self.running:
+            packet = self._send_slot.get()
+            if packet is None:
+                continue
+            try:
+                self.send(packet)
+                self.frames_sent += 1
+                self._last_output = time.monotonic()
+            except Exception as e:
+                self._handle_error('envío', e)
+
+
+class SharedCaptureSource:
+    """Un único bucle de captura para todas las sesiones que miran la misma área"""
+
+    # Segundos sin peticiones (o dos intervalos de la sesión) antes de darla por terminada
+    IDLE_TIMEOUT = 2.0
+
+    def __init__(self, grab, name='captura', metrics=None):
+        """
+        Inicializar fuente
+
+        Args:
+            grab: Función sin argumentos que captura un frame
+            name: Nombre para logs y estadísticas
+            metrics: StageMetrics donde registrar la etapa 'capture'
+        """
+        self._grab = grab
+        self.name = name
+        self.metrics = metrics or StageMetrics()
+        self.pacer = FramePacer(1)
+        self._cond = threading.Condition()
+        # Sesiones suscritas: {id: (fps pedidos, caducidad)}
+        self._demand = {}
+        self._thread = None
+        self._frame = None
+        self._error = None
+        # Hay un grab en curso (del bucle o bajo demanda): los demás esperan su resultado
+        self._grabbing = False
+        self._captured_mono = None
+        self.seq = 0
+        self.captured_at = None
+        self.frames_captured = 0
+        self.frames_reused = 0
+
+    @property
+    def active(self):
+        return self._thread is not None
+
+    def next_frame(self, subscriber, fps, after_seq=0, timeout=1.0):
+        """
+        Esperar un frame más nuevo que 'after_seq'
+
+        La fuente captura al máximo de los FPS pedidos por sus sesiones;
+        cada sesión se queda con los frames que le tocan según su propio ritmo.
+
+        Args:
+            subscriber: ID de la sesión
+            fps: FPS que necesita la sesión
+            after_seq: Último número de frame que recibió la sesión
+            timeout: Segundos máximos de espera
+
+        Returns:
+            Tupla (seq, frame); frame es None si no llegó ninguno a tiempo
+        """
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            self._demand[subscriber] = (fps, time.monotonic() + max(self.IDLE_TIMEOUT, 2.0 / fps))
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._loop, name=f'shared-capture-{self.name}', daemon=True)
+                self._thread.start()
+
+            while self.seq <= after_seq:
+                if self._error is not None:
+                    raise RuntimeError(str(self._error))
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return after_seq, None
+                self._cond.wait(remaining)
+            return self.seq, self._frame
+
+    def unsubscribe(self, subscriber):
+        """Quitar una sesión (el bucle se detiene solo cuando no queda ninguna)"""
+        with self._cond:
+            self._demand.pop(subscriber, None)
+
+    def subscribers(self):
+        with self._cond:
+            return len(self._demand)
+
+    def _loop(self):
+        while True:
+            with self._cond:
+                now = time.monotonic()
+                self._demand = {
+                    subscriber: demand for subscriber, demand in self._demand.items()
+                    if now < demand[1]
+                }
+                if not self._demand:
+                    self._thread = None
+                    return
+                self.pacer.fps = max(fps for fps, _ in self._demand.values())
+
+            self.pacer.wait(lambda: bool(self._demand))
+            if not self._demand:
+                continue
+            try:
+                self._grab_shared()
+            except Exception as e:
+                logger.error(f'❌ Error en captura compartida ({self.name}): {e}')
+                time.sleep(1)
+
+    def _grab_shared(self, timeout=5.0, stage='capture'):
+        """
+        Capturar con un único grab en vuelo: si ya hay uno en curso se espera su resultado
+
+        Args:
+            timeout: Segundos máximos esperando un grab en curso
+            stage: Etapa de StageMetrics en la que se registra el grab
+
+        Returns:
+            Frame capturado
+        """
+        with self._cond:
+            if self._grabbing:
+                seq = self.seq
+                deadline = time.monotonic() + timeout
+                while self._grabbing and self.seq == seq:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        raise TimeoutError(f'Captura en curso sin respuesta ({self.name})')
+                    self._cond.wait(remaining)
+                if self.seq > seq:
+                    return self._frame
+                raise RuntimeError(str(self._error))
+            self._grabbing = True
+
+        try:
+            with self.metrics.time(stage):
+                frame = self._grab()
+        except Exception as e:
+            with self._cond:
+                self._grabbing = False
+                self._error = e
+                self._cond.notify_all()
+            raise
+
+        with self._cond:
+            self._grabbing = False
+            self._frame = frame
+            self._error = None
+            self.seq += 1
+            self.captured_at = time.time()
+            self._captured_mono = time.monotonic()
+            self.frames_captured += 1
+            self._cond.notify_all()
+        return frame
+
+    def latest(self, max_age=0.5, stage='capture'):
+        """
+        Frame reciente para una petición puntual (p. ej. un screenshot)
+
+        Reutiliza el último frame si tiene menos de 'max_age' segundos (el del
+        stream si hay uno activo); si no, captura, compartiendo el grab con
+        cualquier otra petición simultánea.
+
+        Args:
+            max_age: Antigüedad máxima aceptada en segundos (0 = siempre nuevo)
+            stage: Etapa de StageMetrics si hay que capturar (p. ej. 'screenshot.capture')
+
+        Returns:
+            Tupla (frame, captured_at) con la hora de captura (epoch)
+        """
+        with self._cond:
+            if (self._frame is not None and max_age > 0 and
+                    time.monotonic() - self._captured_mono <= max_age):
+                self.frames_reused += 1
+                return self._frame, self.captured_at
+        frame = self._grab_shared(stage=stage)
+        with self._cond:
+            return frame, self.captured_at
+
+    def stats(self):
+        """FPS de captura y sesiones suscritas"""
+        stats = self.pacer.stats()
+        stats.update({
+            'source': self.name,
+            'frames_captured': self.frames_captured,
+            'frames_reused': self.frames_reused,
+            'subscribers': self.subscribers()
+        })
+        return stats
+
+
+class CaptureHub:
+    """Fuentes de captura compartidas por área (monitor + región)"""
+
+    def __init__(self, grab, metrics=None):
+        """
+        Args:
+            grab: Función grab(monitor=..., region=...) que captura un frame
+            metrics: StageMetrics compartido por todas las fuentes
+        """
+        self._grab = grab
+        self.metrics = metrics
+        self._lock = threading.Lock()
+        self._sources = {}
+        # Fuente actual de cada sesión: {id: clave de fuente}
+        self._subscriptions = {}
+
+    @staticmethod
+    def source_key(monitor=None, region=None):
+        """Clave de fuente: dos sesiones con la misma clave comparten capturas"""
+        return (monitor, tuple(sorted(region.items())) if region else None)
+
+    def _source(self, key, monitor, region):
+        source = self._sources.get(key)
+        if source is None:
+            # Olvidar fuentes sin sesiones (p. ej. regiones de ventanas que se movieron)
+            subscribed = set(self._subscriptions.values())
+            for old_key, old in list(self._sources.items()):
+                if not old.active and old_key not in subscribed:
+                    del self._sources[old_key]
+            name = 'default' if monitor is None else f'monitor-{monitor}'
+            if region:
+                name += f"@{region['left']},{region['top']}+{region['width']}x{region['height']}"
+            source = SharedCaptureSource(lambda: self._grab(monitor=monitor, region=region), name, self.metrics)
+            self._sources[key] = source
+        return source
+
+    def next_frame(self, subscriber, fps, monitor=None, region=None, last=None, timeout=1.0):
+        """
+        Siguiente frame compartido para una sesión
+
+        Args:
+            subscriber: ID de la sesión
+            fps: FPS que necesita la sesión
+            monitor: Índice de monitor, 'all' o None
+            region: Región absoluta o None
+            last: Token devuelto en la llamada anterior (None la primera vez)
+            timeout: Segundos máximos de espera
+
+        Returns:
+            Tupla (token, frame); frame es None si no llegó ninguno a tiempo
+        """
+        key = self.source_key(monitor, region)
+        with self._lock:
+            previous = self._subscriptions.get(subscriber)
+            if previous != key and previous in self._sources:
+                self._sources[previous].unsubscribe(subscriber)
+            self._subscriptions[subscriber] = key
+            source = self._source(key, monitor, region)
+
+        after_seq = last[1] if last and last[0] is source else 0
+        seq, frame = source.next_frame(subscriber, fps, after_seq, timeout)
+        return (source, seq), frame
+
+    def latest(self, monitor=None, region=None, max_age=0.5, stage='capture'):
+        """
+        Frame reciente de un área para una petición puntual
+
+        Args:
+            monitor: Índice de monitor, 'all' o None
+            region: Región (relativa al monitor si se indica uno) o None
+            max_age: Antigüedad máxima aceptada en segundos
+            stage: Etapa de StageMetrics en la que se registra el grab, si lo hay
+
+        Returns:
+            Tupla (frame, captured_at)
+        """
+        key = self.source_key(monitor, region)
+        with self._lock:
+            source = self._source(key, monitor, region)
+        return source.latest(max_age, stage)
+
+    def unsubscribe(self, subscriber):
+        """Quitar una sesión de su fuente"""
+        with self._lock:
+            key = self._subscriptions.pop(subscriber, None)
+            if key in self._sources:
+                self._sources[key].unsubscribe(subscriber)
+
+    def stats(self):
+        """Estadísticas de las fuentes con sesiones"""
+        with self._lock:
+            sources = list(self._sources.values())
+        return [source.stats() for source in sources if source.active]
+
+
+def _no_frame():
+    """Referencia inicial de una variante: nunca coincide con un frame"""
+    return None
+
+
+class RenditionCache:
+    """Cada variante (escala, calidad, codificador) de un frame compartido se codifica una sola vez"""
+
+    # Variantes recordadas (solo el resultado codificado: el frame se referencia débilmente)
+    MAX_RENDITIONS = 16
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, rendition, frame, produce):
+        """
+        Resultado codificado de 'frame' en la variante 'rendition'
+
+        Si otra sesión ya codificó este mismo frame con la misma variante se
+        reutiliza; si lo está codificando en este momento, se espera a que termine.
+
+        Args:
+            rendition: Tupla con los parámetros de la variante
+            frame: Frame compartido (se compara por identidad)
+            produce: Función sin argumentos que codifica el frame
+
+        Returns:
+            Resultado de produce() (compartido: no modificarlo)
+        """
+        with self._lock:
+            entry = self._entries.get(rendition)
+            if entry is None:
+                entry = {'frame': _no_frame, 'result': None, 'lock': threading.Lock()}
+                self._entries[rendition] = entry
+                if len(self._entries) > self.MAX_RENDITIONS:
+                    self._entries.popitem(last=False)
+            else:
+                self._entries.move_to_end(rendition)
+
+        with entry['lock']:
+            if entry['frame']() is frame:
+                with self._lock:
+                    self.hits += 1
+                return entry['result']
+            result = produce()
+            # Sin referencia fuerte: una variante abandonada no mantiene vivo un frame a
+            # resolución completa, y su resultado se libera cuando el frame desaparece
+            entry['frame'] = weakref.ref(frame, lambda ref: self._release(entry, ref))
+            entry['result'] = result
+            with self._lock:
+                self.misses += 1
+            return result
+
+    @staticmethod
+    def _release(entry, ref):
+        """Callback del weakref: el frame se liberó, su resultado ya no sirve"""
+        if entry['frame'] is ref:
+            entry['result'] = None
+
+    def stats(self):
+        with self._lock:
+            return {'renditions': len(self._entries), 'hits': self.hits, 'misses': self.misses}
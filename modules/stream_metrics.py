@@ -0,0 +1,127 @@
+"""
+Módulo de métricas del stream
+Histogramas de latencia por etapa (captura, escalado, codificación, base64, envío)
+"""
+import time
+import threading
+from collections import deque
+from contextlib import nullcontext
+
+# Contexto vacío compartido: con las métricas desactivadas no se mide nada
+_DISABLED = nullcontext()
+
+
+class LatencyHistogram:
+    """Ventana rodante de latencias con percentiles bajo demanda"""
+
+    def __init__(self, window=500):
+        """
+        Args:
+            window: Número de muestras recientes que se conservan
+        """
+        self._samples = deque(maxlen=window)
+        self.count = 0
+
+    def record(self, ms):
+        self._samples.append(ms)
+        self.count += 1
+
+    def percentiles(self):
+        """
+        Percentiles de la ventana actual
+
+        Returns:
+            Dict con 'count' (total histórico), 'p50', 'p95', 'p99' y 'max' en ms
+        """
+        samples = sorted(self._samples)
+        if not samples:
+            return {'count': self.count}
+
+        def pick(p):
+            return round(samples[min(len(samples) - 1, int(p * len(samples)))], 2)
+
+        return {
+            'count': self.count,
+            'p50': pick(0.50),
+            'p95': pick(0.95),
+            'p99': pick(0.99),
+            'max': round(samples[-1], 2)
+        }
+
+
+class _StageTimer:
+    """Context manager que mide una etapa y la registra al salir"""
+
+    __slots__ = ('_metrics', '_stage', '_start')
+
+    def __init__(self, metrics, stage):
+        self._metrics = metrics
+        self._stage = stage
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self._metrics.record(self._stage, (time.perf_counter() - self._start) * 1000)
+        return False
+
+
+class StageMetrics:
+    """Tiempos por etapa del pipeline (desactivado: solo el coste de un 'with' vacío)"""
+
+    def __init__(self, enabled=False, window=500):
+        """
+        Inicializar métricas
+
+        Args:
+            enabled: Medir desde el principio
+            window: Muestras por histograma
+        """
+        self.enabled = enabled
+        self.window = window
+        self._lock = threading.Lock()
+        self._histograms = {}
+        self._since = time.time()
+
+    def time(self, stage):
+        """
+        Medir un bloque: with metrics.time('encode'): ...
+
+        Args:
+            stage: Nombre de la etapa (None = no medir)
+        """
+        if not self.enabled or stage is None:
+            return _DISABLED
+        return _StageTimer(self, stage)
+
+    def record(self, stage, ms):
+        """Registrar una duración ya medida (ms)"""
+        if not self.enabled:
+            return
+        with self._lock:
+            histogram = self._histograms.get(stage)
+            if histogram is None:
+                histogram = self._histograms[stage] = LatencyHistogram(self.window)
+            histogram.record(ms)
+
+    def reset(self):
+        """Vaciar todos los histogramas"""
+        with self._lock:
+            self._histograms = {}
+            self._since = time.time()
+
+    def snapshot(self):
+        """
+        Percentiles de todas las etapas medidas
+
+        Returns:
+            Dict con 'enabled', 'since' y 'stages' ({etapa: percentiles})
+        """
+        with self._lock:
+            stages = {stage: histogram.percentiles() for stage, histogram in self._histograms.items()}
+        return {
+            'enabled': self.enabled,
+            'since': self._since,
+            'stages': stages
+        }
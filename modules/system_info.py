@@ -4,82 +4,260 @@ Módulo de información del sistema
 import psutil
 import platform
 import socket
+import time
+import json
+import hashlib
+import logging
+import threading
+from collections import deque
 from datetime import datetime
 
+from .address_tracker import AddressTracker
+
+logger = logging.getLogger(__name__)
+
 
 class SystemInfo:
     """Obtener información del sistema"""
     
+    def __init__(self, sample_interval=2.0, history_size=150):
+        """
+        Inicializar muestreo de telemetría
+        
+        Args:
+            sample_interval: Segundos entre muestras del hilo de fondo
+            history_size: Muestras recientes que se conservan (ring buffer)
+        """
+        self.sample_interval = sample_interval
+        self.history = deque(maxlen=history_size)
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._first_sample = threading.Event()
+        self._thread = None
+        self._platform = None
+        self._inventory = None
+        self._inventory_hash = None
+        # IP cacheada: se actualiza con los avisos del kernel, no con cada consulta
+        self.address_tracker = AddressTracker()
+    
+    def start_sampler(self):
+        """Arrancar el hilo de muestreo (idempotente)"""
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._sample_loop, name='system-sampler', daemon=True)
+            self._thread.start()
+    
+    def stop_sampler(self):
+        """Detener el hilo de muestreo"""
+        self._stop.set()
+    
+    def _sample_loop(self):
+        # La primera llamada sin intervalo solo fija la referencia de CPU
+        psutil.cpu_percent(interval=None)
+        self._stop.wait(0.2)
+        previous = None
+        while not self._stop.is_set():
+            try:
+                sample = self._take_sample(previous)
+                with self._lock:
+                    self.history.append(sample)
+                previous = sample
+            except Exception as e:
+                logger.error(f'Error muestreando el sistema: {e}')
+            self._first_sample.set()
+            self._stop.wait(self.sample_interval)
+    
     @staticmethod
-    def get_system_stats():
-        """Obtener estadísticas del sistema"""
+    def _take_sample(previous=None):
+        """Una lectura de CPU, memoria, disco y red (sin bloquear)"""
+        now = time.monotonic()
+        memory = psutil.virtual_memory()
+        disk = psutil.disk_usage('/')
+        net_io = psutil.net_io_counters()
+        
+        network = {
+            'bytes_sent': net_io.bytes_sent,
+            'bytes_recv': net_io.bytes_recv
+        }
+        if previous is not None and now > previous['monotonic']:
+            elapsed = now - previous['monotonic']
+            network['sent_per_s'] = int((net_io.bytes_sent - previous['network']['bytes_sent']) / elapsed)
+            network['recv_per_s'] = int((net_io.bytes_recv - previous['network']['bytes_recv']) / elapsed)
+        
+        return {
+            'timestamp': time.time(),
+            'monotonic': now,
+            # CPU media desde la muestra anterior
+            'cpu_percent': psutil.cpu_percent(interval=None),
+            'memory': {
+                'percent': memory.percent,
+                'total_gb': round(memory.total / (1024 ** 3), 2),
+                'used_gb': round(memory.used / (1024 ** 3), 2)
+            },
+            'disk': {
+                'percent': disk.percent,
+                'total_gb': round(disk.total / (1024 ** 3), 2),
+                'used_gb': round(disk.used / (1024 ** 3), 2)
+            },
+            'network': network
+        }
+    
+    def latest_sample(self):
+        """
+        Última muestra del ring buffer (arranca el muestreo si hace falta)
+        
+        Returns:
+            Dict de la muestra o None si aún no hay ninguna
+        """
+        self.start_sampler()
+        # Solo la primera consulta tras arrancar espera (≈0.2 s) a la primera muestra
+        self._first_sample.wait(timeout=1.0)
+        with self._lock:
+            return self.history[-1] if self.history else None
+    
+    def get_history(self, since=None):
+        """
+        Muestras del ring buffer
+        
+        Args:
+            since: Solo las posteriores a este timestamp (epoch)
+            
+        Returns:
+            Lista de muestras en orden cronológico
+        """
+        with self._lock:
+            return [sample for sample in self.history if since is None or sample['timestamp'] > since]
+    
+    def get_static_info(self):
+        """Datos estáticos del sistema (platform.processor() puede lanzar un proceso: se cachea)"""
+        if self._platform is None:
+            self._platform = {
+                'platform': platform.system(),
+                'release': platform.release(),
+                'version': platform.version(),
+                'machine': platform.machine(),
+                'processor': platform.processor(),
+                'hostname': socket.gethostname(),
+                'boot_time': psutil.boot_time()
+            }
+        return dict(self._platform)
+    
+    @staticmethod
+    def _cpu_model():
+        """Modelo de CPU legible (platform.processor() suele venir vacío en Linux)"""
         try:
-            # CPU
-            cpu_percent = psutil.cpu_percent(interval=1)
-            cpu_count = psutil.cpu_count()
+            with open('/proc/cpuinfo') as cpuinfo:
+                for line in cpuinfo:
+                    if line.startswith('model name'):
+                        return line.split(':', 1)[1].strip()
+        except OSError:
+            pass
+        return platform.processor() or platform.machine()
+    
+    @staticmethod
+    def _disks():
+        """Particiones físicas con su capacidad"""
+        disks = []
+        for partition in psutil.disk_partitions(all=False):
+            try:
+                total = psutil.disk_usage(partition.mountpoint).total
+            except (PermissionError, OSError):
+                continue
+            disks.append({
+                'device': partition.device,
+                'mountpoint': partition.mountpoint,
+                'fstype': partition.fstype,
+                'total_gb': round(total / (1024 ** 3), 2)
+            })
+        return disks
+    
+    @staticmethod
+    def _mac_addresses():
+        """Direcciones MAC por interfaz (sin loopback)"""
+        macs = {}
+        for interface, addresses in psutil.net_if_addrs().items():
+            for address in addresses:
+                if address.family == psutil.AF_LINK and address.address and \
+                        address.address != '00:00:00:00:00:00':
+                    macs[interface] = address.address
+        return dict(sorted(macs.items()))
+    
+    def get_host_inventory(self, monitors=None):
+        """
+        Inventario estático del equipo (se recopila una sola vez y se cachea)
+        
+        Args:
+            monitors: Función que devuelve la geometría de los monitores
+                      (solo se llama en la primera recopilación)
             
-            # Memoria
+        Returns:
+            Tupla (inventario, hash): el hash identifica el contenido para que el
+            servidor solo pida el inventario completo cuando no lo tiene
+        """
+        if self._inventory is None:
+            static = self.get_static_info()
             memory = psutil.virtual_memory()
-            memory_percent = memory.percent
-            memory_total = memory.total / (1024 ** 3)  # GB
-            memory_used = memory.used / (1024 ** 3)    # GB
-            
-            # Disco
-            disk = psutil.disk_usage('/')
-            disk_percent = disk.percent
-            disk_total = disk.total / (1024 ** 3)  # GB
-            disk_used = disk.used / (1024 ** 3)    # GB
-            
-            # Red
-            net_io = psutil.net_io_counters()
+            inventory = {
+                'hostname': static['hostname'],
+                'os': {
+                    'system': static['platform'],
+                    'release': static['release'],
+                    'version': static['version'],
+                    'machine': static['machine']
+                },
+                'cpu': {
+                    'model': self._cpu_model(),
+                    'physical_cores': psutil.cpu_count(logical=False),
+                    'logical_cores': psutil.cpu_count()
+                },
+                'memory_gb': round(memory.total / (1024 ** 3), 2),
+                'disks': self._disks(),
+                'mac_addresses': self._mac_addresses(),
+                'monitors': monitors() if monitors else []
+            }
+            # JSON canónico: el mismo equipo produce siempre el mismo hash
+            canonical = json.dumps(inventory, sort_keys=True, separators=(',', ':'), default=str)
+            self._inventory_hash = hashlib.sha256(canonical.encode()).hexdigest()[:16]
+            self._inventory = inventory
+            logger.info(f'Inventario del equipo recopilado (hash {self._inventory_hash})')
+        return self._inventory, self._inventory_hash
+    
+    @staticmethod
+    def get_uptime():
+        """Tiempo desde el arranque como 'H:MM:SS'"""
+        boot_time = datetime.fromtimestamp(psutil.boot_time())
+        return str(datetime.now() - boot_time).split('.')[0]
+    
+    def get_system_stats(self):
+        """Obtener estadísticas del sistema (desde la caché del muestreo, sin bloquear)"""
+        try:
+            sample = self.latest_sample()
+            if sample is None:
+                sample = self._take_sample()
             
-            # Sistema
-            boot_time = datetime.fromtimestamp(psutil.boot_time())
-            uptime = str(datetime.now() - boot_time).split('.')[0]
+            system = self.get_static_info()
+            system['uptime'] = self.get_uptime()
             
             return {
                 'cpu': {
-                    'percent': cpu_percent,
-                    'count': cpu_count
-                },
-                'memory': {
-                    'percent': memory_percent,
-                    'total_gb': round(memory_total, 2),
-                    'used_gb': round(memory_used, 2)
+                    'percent': sample['cpu_percent'],
+                    'count': psutil.cpu_count()
                 },
-                'disk': {
-                    'percent': disk_percent,
-                    'total_gb': round(disk_total, 2),
-                    'used_gb': round(disk_used, 2)
-                },
-                'network': {
-                    'bytes_sent': net_io.bytes_sent,
-                    'bytes_recv': net_io.bytes_recv
-                },
-                'system': {
-                    'platform': platform.system(),
-                    'release': platform.release(),
-                    'version': platform.version(),
-                    'machine': platform.machine(),
-                    'processor': platform.processor(),
-                    'hostname': socket.gethostname(),
-                    'uptime': uptime
-                }
+                'memory': sample['memory'],
+                'disk': sample['disk'],
+                'network': sample['network'],
+                'system': system,
+                'sampled_at': sample['timestamp'],
+                'sample_age': round(time.monotonic() - sample['monotonic'], 3)
             }
         except Exception as e:
             return {'error': str(e)}
     
-    @staticmethod
-    def get_ip_address():
-        """Obtener dirección IP del servidor"""
-        try:
-            s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-            s.connect(("8.8.8.8", 80))
-            ip = s.getsockname()[0]
-            s.close()
-            return ip
-        except:
-            return "127.0.0.1"
+    def get_ip_address(self):
+        """Obtener la dirección IP principal (cacheada por el seguimiento de direcciones)"""
+        return self.address_tracker.ip
     
     @staticmethod
     def get_network_interfaces():
@@ -0,0 +1,179 @@
+"""
+Módulo de telemetría push
+El agente envía sus estadísticas al intervalo que pide el servidor: una instantánea
+completa y después solo los campos que cambiaron
+"""
+import time
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+# Campos de la muestra que no se transmiten (locales o que cambian siempre)
+SKIPPED_FIELDS = ('monotonic', 'timestamp')
+
+
+def flatten(data, prefix=''):
+    """
+    Aplanar un dict anidado a claves con puntos
+
+    Args:
+        data: Dict anidado
+        prefix: Prefijo de las claves
+
+    Returns:
+        Dict {'memory.percent': 41.2, ...}
+    """
+    flat = {}
+    for key, value in data.items():
+        path = f'{prefix}{key}'
+        if isinstance(value, dict):
+            flat.update(flatten(value, f'{path}.'))
+        else:
+            flat[path] = value
+    return flat
+
+
+def _is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+class TelemetryDeltaEncoder:
+    """Instantánea completa y luego solo cambios (deltas numéricos y valores nuevos)"""
+
+    def __init__(self, keyframe_interval=60.0, precision=2):
+        """
+        Inicializar codificador
+
+        Args:
+            keyframe_interval: Segundos entre instantáneas completas (resincroniza
+                               el estado del servidor y corrige el redondeo)
+            precision: Decimales de los deltas de coma flotante
+        """
+        self.keyframe_interval = keyframe_interval
+        self.precision = precision
+        self._last = None
+        self._last_keyframe = 0.0
+
+    def request_keyframe(self):
+        """Forzar una instantánea completa en el siguiente mensaje"""
+        self._last = None
+
+    def encode(self, data):
+        """
+        Codificar un estado
+
+        Args:
+            data: Dict (anidado) con el estado actual
+
+        Returns:
+            {'type': 'snapshot', 'data': {...}} o
+            {'type': 'delta', 'delta': {clave: incremento}, 'set': {clave: valor}, 'unset': [...]},
+            o None si nada cambió
+        """
+        flat = flatten(data)
+        now = time.monotonic()
+
+        if self._last is None or now - self._last_keyframe >= self.keyframe_interval:
+            self._last = flat
+            self._last_keyframe = now
+            return {'type': 'snapshot', 'data': data}
+
+        delta, changed = {}, {}
+        for key, value in flat.items():
+            previous = self._last.get(key)
+            if key in self._last and previous == value:
+                continue
+            if _is_number(value) and _is_number(previous):
+                diff = value - previous
+                if isinstance(diff, float):
+                    diff = round(diff, self.precision)
+                # El servidor acumula el delta redondeado: recordar ese mismo valor
+                flat[key] = previous + diff
+                if diff:
+                    delta[key] = diff
+            else:
+                changed[key] = value
+        removed = [key for key in self._last if key not in flat]
+        self._last = flat
+
+        if not (delta or changed or removed):
+            return None
+        message = {'type': 'delta'}
+        if delta:
+            message['delta'] = delta
+        if changed:
+            message['set'] = changed
+        if removed:
+            message['unset'] = removed
+        return message
+
+
+class TelemetryStream:
+    """Hilo que envía la telemetría del agente al intervalo elegido por el servidor"""
+
+    def __init__(self, system_info, emit, interval=5.0, keyframe_interval=60.0):
+        """
+        Inicializar stream
+
+        Args:
+            system_info: Instancia de SystemInfo (su muestreo de fondo alimenta el stream)
+            emit: Función emit(payload)
+            interval: Segundos entre envíos
+            keyframe_interval: Segundos entre instantáneas completas
+        """
+        self.system_info = system_info
+        self.emit = emit
+        self.interval = max(0.5, float(interval))
+        self.encoder = TelemetryDeltaEncoder(keyframe_interval)
+        self.seq = 0
+        self.messages_sent = 0
+        self.messages_skipped = 0
+        self._stop = threading.Event()
+        self._thread = None
+        self._previous_sample_interval = None
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive() and not self._stop.is_set()
+
+    def start(self):
+        # El muestreo debe ser al menos tan frecuente como los envíos (se restaura en stop)
+        self._previous_sample_interval = self.system_info.sample_interval
+        self.system_info.sample_interval = min(self.system_info.sample_interval, self.interval)
+        self.system_info.start_sampler()
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._loop, name='telemetry-stream', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._previous_sample_interval is not None:
+            self.system_info.sample_interval = self._previous_sample_interval
+            self._previous_sample_interval = None
+
+    def _state(self):
+        """Estado actual: la última muestra sin los campos locales"""
+        sample = self.system_info.latest_sample()
+        if sample is None:
+            return None
+        return {key: value for key, value in sample.items() if key not in SKIPPED_FIELDS}
+
+    def _loop(self):
+        while not self._stop.is_set():
+            try:
+                state = self._state()
+                message = self.encoder.encode(state) if state is not None else None
+                if message is None:
+                    self.messages_skipped += 1
+                else:
+                    if message['type'] == 'snapshot':
+                        message['system'] = self.system_info.get_static_info()
+                    message['seq'] = self.seq
+                    message['timestamp'] = time.time()
+                    self.emit(message)
+                    self.seq += 1
+                    self.messages_sent += 1
+            except Exception as e:
+                logger.error(f'❌ Error en telemetría: {e}')
+            self._stop.wait(self.interval)